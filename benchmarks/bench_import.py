@@ -0,0 +1,78 @@
+#
+# Start-up cost benchmarks:
+#
+#   python benchmarks/bench_import.py [--rounds 10] [--max-import-ms 50]
+#
+# Reports the time a fresh interpreter takes to import the package and the
+# client class, the cost of constructing a VenstarColorTouch, and which
+# heavy dependencies got imported along the way.  With --max-import-ms the
+# exit status is 1 if importing the client takes longer, or if any of them
+# was imported before the first request, so start-up regressions fail CI.
+#
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+HEAVY = ("requests", "urllib3", "httpx", "numpy", "orjson", "http.server", "concurrent.futures")
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import venstarcolortouch
+package = time.perf_counter() - start
+start = time.perf_counter()
+from venstarcolortouch import VenstarColorTouch
+client = time.perf_counter() - start
+start = time.perf_counter()
+for i in range(1000):
+    VenstarColorTouch("192.0.2.1", timeout=5, user="user", password="password")
+construct = (time.perf_counter() - start) / 1000
+print(json.dumps({"package": package, "client": client, "construct": construct,
+                  "loaded": [name for name in HEAVY if name in sys.modules]}))
+"""
+
+
+def probe():
+    env = dict(os.environ, PYTHONPATH=SRC + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    code = "import json\nHEAVY = {0!r}\n".format(HEAVY) + PROBE
+    out = subprocess.run([sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=10, help="fresh interpreters to start")
+    parser.add_argument("--max-import-ms", type=float, default=None,
+                        help="fail if importing VenstarColorTouch takes longer than this")
+    args = parser.parse_args()
+
+    results = [probe() for i in range(args.rounds)]
+    package = statistics.median(result["package"] for result in results) * 1000
+    client = statistics.median(result["client"] for result in results) * 1000
+    construct = statistics.median(result["construct"] for result in results) * 1e6
+    loaded = sorted({name for result in results for name in result["loaded"]})
+
+    print("Start-up cost, median of {0} fresh interpreters".format(args.rounds))
+    print("  import venstarcolortouch             {0:7.2f} ms".format(package))
+    print("  from ... import VenstarColorTouch    {0:7.2f} ms".format(client))
+    print("  VenstarColorTouch(...)               {0:7.2f} us".format(construct))
+    print("  heavy modules loaded before a request: {0}".format(", ".join(loaded) or "none"))
+
+    if args.max_import_ms is not None:
+        failed = False
+        if package + client > args.max_import_ms:
+            print("FAIL: import took {0:.2f} ms, limit {1:.2f} ms".format(package + client, args.max_import_ms))
+            failed = True
+        if loaded:
+            print("FAIL: imported before the first request: {0}".format(", ".join(loaded)))
+            failed = True
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#
+# Offline benchmarks against the simulated thermostat:
+#
+#   python benchmarks/bench_update.py [--latency 0.02] [--devices 1 100 1000]
+#
+# Reports update() latency (serial and concurrent), requests made per
+# refresh, and ThermostatFleet throughput for each fleet size.
+#
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from venstarcolortouch import VenstarColorTouch, ThermostatFleet
+from venstarcolortouch.simulator import SimulatedThermostat, SimulatedFleet
+
+
+def bench_update(latency, rounds, settings_only):
+    print("update() latency, {0:.0f} ms simulated latency, {1} rounds".format(latency * 1000, rounds))
+    for concurrent in (False, True):
+        with SimulatedThermostat(latency=latency, settings_only=settings_only) as sim:
+            with VenstarColorTouch(sim.addr, timeout=5) as ct:
+                ct.update(concurrent=concurrent)
+                sim.reset_stats()
+                times = []
+                for i in range(rounds):
+                    # runtimes are served from cache after the first update
+                    start = time.perf_counter()
+                    ct.update(concurrent=concurrent)
+                    times.append(time.perf_counter() - start)
+            print("  {0:<10} median {1:7.1f} ms  p95 {2:7.1f} ms  {3:.1f} requests/refresh  {4} new connection(s)".format(
+                "concurrent" if concurrent else "serial",
+                statistics.median(times) * 1000,
+                sorted(times)[int(len(times) * 0.95) - 1] * 1000,
+                sim.request_count / rounds,
+                sim.connections))
+
+
+def bench_fleet(count, latency, workers, rounds):
+    with SimulatedFleet(count, latency=latency) as sims:
+        fleet = ThermostatFleet(max_workers=workers, intervals={"info": 0, "sensors": 0, "alerts": 0, "runtimes": 0},
+                                jitter=0)
+        for addr in sims.addrs:
+            fleet.add(VenstarColorTouch(addr, timeout=10))
+        fleet.poll_once()
+        sims.reset_stats()
+        start = time.perf_counter()
+        for i in range(rounds):
+            results = fleet.poll_once()
+        elapsed = time.perf_counter() - start
+        fleet.close()
+        failed = sum(1 for ok in results.values() if not ok)
+        print("  {0:>5} devices  {1:8.1f} device polls/s  {2:8.1f} requests/s  {3} failed".format(
+            count, count * rounds / elapsed, sims.request_count / elapsed, failed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated per-request latency (s)")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--settings-only", nargs="*", default=["hum_setpoint", "dehum_setpoint"],
+                        help="settings the simulated model only reports at /settings")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    bench_update(args.latency, args.rounds, args.settings_only)
+    print("ThermostatFleet throughput, {0} workers".format(args.workers))
+    for count in args.devices:
+        bench_fleet(count, args.latency, args.workers, max(1, args.rounds // 10))
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,11 @@ CLASSIFIERS = [
 INSTALL_REQUIRES = [
         "requests>=2.14.1"
 ]
+EXTRAS_REQUIRE = {
+        "async": ["httpx>=0.18"],
+        "analytics": ["numpy>=1.17"],
+        "speedups": ["orjson"],
+}
 
 ###################################################################
 
@@ -74,4 +79,5 @@ if __name__ == "__main__":
         zip_safe=False,
         classifiers=CLASSIFIERS,
         install_requires=INSTALL_REQUIRES,
+        extras_require=EXTRAS_REQUIRE,
     )
@@ -12,6 +12,45 @@ __license__ = "MIT"
 
 __copyright__ = "Copyright (c) 2017 Herb Peyerl"
 
-from .venstarcolortouch import VenstarColorTouch
+from .state import (Mode, State, Fan, FanState, TempUnits, Security, Sched, SchedPart, Away,
+                    ThermostatState, SensorReading, ThermostatSnapshot)
+
+#
+# Everything else is imported on first use, so "import venstarcolortouch"
+# doesn't pull in requests, httpx or the fleet machinery.
+#
+_LAZY = {
+    "VenstarColorTouch": "venstarcolortouch",
+    "AsyncVenstarColorTouch": "aio",
+    "ThermostatFleet": "fleet",
+    "AdaptiveSchedule": "scheduler",
+    "RuntimeStore": "runtimes",
+    "Recorder": "recorder",
+    "SeriesStore": "recorder",
+    "CapabilityCache": "capabilities",
+    "CircuitBreaker": "breaker",
+    "Instrumentation": "instrumentation",
+    "MetricsCollector": "instrumentation",
+    "ShardedPoller": "sharded",
+    "StateTable": "sharded",
+}
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+    import importlib
+    try:
+        value = getattr(importlib.import_module("." + module, __name__), name)
+    except ImportError as error:
+        # httpx is optional; install venstarcolortouch[async] for the asyncio client
+        raise AttributeError("{0} is not available: {1}".format(name, error)) from error
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
 
 if __name__ == '__main__': print(__version__)
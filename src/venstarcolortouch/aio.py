@@ -0,0 +1,454 @@
+import asyncio
+import functools
+import json
+import time
+import urllib.parse
+
+import httpx
+
+from .base import VenstarColorTouchBase, POOL_MAXSIZE
+
+
+#
+# asyncio.Lock that the task holding it may take again, as set_away() does
+# through set_schedule() and set_* calls inside batch() do.
+#
+class _WriteLock:
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._owner = None
+        self._depth = 0
+
+    async def acquire(self):
+        task = asyncio.current_task()
+        if self._owner is not task:
+            await self._lock.acquire()
+            self._owner = task
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if not self._depth:
+            self._owner = None
+            self._lock.release()
+
+
+# Runs set_* calls on one instance one at a time, like VenstarColorTouch
+def _serialized(method):
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        await self._lock_writes()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            self._unlock_writes()
+    return wrapper
+
+#
+# asyncio flavour of VenstarColorTouch.  The public surface is the same, but
+# everything that talks to the thermostat is a coroutine.  Pass a shared
+# httpx.AsyncClient as ``client`` to pool connections across many thermostats.
+#
+class AsyncVenstarColorTouch(VenstarColorTouchBase):
+    def __init__(self, addr, timeout, user=None, password=None, pin=None, proto='http', SSLCert=False,
+                 runtimes_store=None, optimistic=False, verify_delay=2.0, client=None, pool_maxsize=POOL_MAXSIZE,
+                 capability_cache=None, connect_timeout=None, breaker=None,
+                 instrumentation=None):
+        super().__init__(addr, timeout, user=user, password=password, pin=pin, proto=proto, SSLCert=SSLCert,
+                         runtimes_store=runtimes_store, optimistic=optimistic, verify_delay=verify_delay,
+                         capability_cache=capability_cache, connect_timeout=connect_timeout, breaker=breaker,
+                         instrumentation=instrumentation)
+        self._timeouts = httpx.Timeout(timeout, connect=connect_timeout if connect_timeout is not None else timeout)
+
+        if user != None and password != None:
+            self.auth = httpx.DigestAuth(user, password)
+        else:
+            self.auth = None
+
+        self.pool_maxsize = pool_maxsize
+        self._client = client
+        self._owns_client = client is None
+        self._write_lock = _WriteLock()
+
+    def _get_client(self):
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.pool_maxsize,
+                                  max_keepalive_connections=self.pool_maxsize)
+            self._client = httpx.AsyncClient(verify=self.SSLCert, limits=limits)
+        return self._client
+
+    async def close(self):
+        if self._verify_handle is not None:
+            self._verify_handle.cancel()
+            self._verify_handle = None
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def login(self, force=False):
+        # A warm capability cache answers without asking the thermostat
+        if not force and self._login_cached():
+            return True
+        r = await self._request("/")
+        if r is False:
+            if not self.breaker.consecutive_failures:
+                self.log.error("Failed to request thermostat info in login")
+            return r
+        if not self._parse_login(self._json(r)):
+            return False
+        self._remember_login()
+        return True
+
+    async def _request(self, path, data=None):
+        uri = self._uri(path)
+        # httpx replaces rather than extends a query string already in the
+        # path (e.g. /settings?q=), and re-encodes it when merging, so append
+        # the pin by hand
+        params = self._params()
+        url = uri
+        if params:
+            url += ("&" if "?" in uri else "?") + urllib.parse.urlencode(params)
+        client = self._get_client()
+        auth = self.auth if self.auth is not None else httpx.USE_CLIENT_DEFAULT
+        if data is not None:
+            # set_* functions change local state before writing it
+            self._info_valid = False
+        if self._circuit_open(path, uri):
+            return False
+        start = time.perf_counter()
+        try:
+            if data is not None:
+                req = await client.post(url,
+                                        timeout=self._timeouts,
+                                        content=data,
+                                        headers={"Content-Type": "application/x-www-form-urlencoded"},
+                                        auth=auth)
+            else:
+                req = await client.get(url,
+                                       timeout=self._timeouts,
+                                       auth=auth)
+        except Exception as ex:
+            self._request_failed(path, uri, ex)
+            return False
+        self._request_succeeded(path, "GET" if data is None else "POST", start, req)
+
+        if not req.is_success:
+            self.log.error("Connection error logging into Venstar ColorTouch. Status Code: {status}".format(status=req.status_code))
+            return False
+
+        return req
+
+    async def update(self, alerts = True, info = True, runtimes = True, sensors = True, concurrent = False):
+        if concurrent:
+            return await self._update_concurrent(alerts, info, runtimes, sensors)
+        if alerts:
+            if not await self.update_alerts():
+                return False
+        if info:
+            if not await self.update_info():
+                return False
+        if runtimes:
+            if not await self.update_runtimes():
+                return False
+        if sensors:
+            if not await self.update_sensors():
+                return False
+        return True
+
+    async def _update_concurrent(self, alerts, info, runtimes, sensors):
+        fetchers = {}
+        if alerts:
+            fetchers["alerts"] = self.get_alerts
+        if info:
+            fetchers["info"] = self._fetch_info
+        if runtimes:
+            fetchers["runtimes"] = self.get_runtimes
+        if sensors:
+            fetchers["sensors"] = self._fetch_sensors
+
+        since = self._writes
+        values = await asyncio.gather(*(self._fetch_safely(endpoint, fetch)
+                                        for endpoint, fetch in fetchers.items()))
+        self.update_results = self._apply_updates(dict(zip(fetchers, values)), since)
+        return all(self.update_results.values())
+
+    async def _fetch_safely(self, endpoint, fetch):
+        try:
+            return await fetch()
+        except Exception:
+            self.log.exception("Failed to update {0} from Venstar ColorTouch.".format(endpoint))
+            return False
+
+    async def _fetch_info(self):
+        # Model number (set during login) *required* for update_info()
+        if self.model is None:
+            self.log.debug("update_info() called without login(), executing login()")
+            if not await self.login():
+                if not self.breaker.consecutive_failures:
+                    self.log.error("Login failed during update_info() call!")
+                return False
+
+        r = await self._request("/query/info")
+
+        if r is False:
+            return r
+
+        try:
+            # copied because settings get merged in below
+            info = dict(self._decode("info", r))
+        except json.decoder.JSONDecodeError as error:
+            self.log.error("Failed to decode JSON: %s", error.msg)
+            return False
+
+        attrs = self._settings_to_fetch(info)
+        if attrs:
+            info.update(await self._fetch_settings(attrs))
+        return info
+
+    async def _query_settings(self, attrs):
+        r = await self._request(self._settings_query(attrs))
+        if not r:
+            return None
+        j = self._json(r)
+        return {attr: j[attr] for attr in attrs if attr in j}
+
+    async def _fetch_settings(self, attrs):
+        batched = None
+        tried = self._try_batch(attrs)
+        if tried:
+            batched = await self._query_settings(attrs)
+
+        rest = self._settings_rest(attrs, batched)
+        answers = await asyncio.gather(*(self._query_settings([attr]) for attr in rest))
+        return self._learn_settings(attrs, batched, dict(zip(rest, answers)), tried)
+
+    async def update_info(self):
+        since = self._writes
+        info = await self._fetch_info()
+        if info is False:
+            return False
+
+        self._set_info(info, since)
+        return True
+
+    async def _fetch_sensors(self):
+        r = await self._request("/query/sensors")
+        if r is False:
+            return r
+        return self._decode("sensors", r)
+
+    async def update_sensors(self):
+        sensors = await self._fetch_sensors()
+        if sensors is False:
+            return sensors
+        self._set_sensors(sensors)
+        return True
+
+    async def get_runtimes(self, force=False):
+        if not force:
+            cached = self._cached_runtimes()
+            if cached is not None:
+                return cached
+        r = await self._request("/query/runtimes")
+        if r is False:
+            return r
+        return self._store_runtimes(self._decode("runtimes", r)["runtimes"])
+
+    async def update_runtimes(self):
+        self._set_runtimes(await self.get_runtimes())
+        if self.runtimes:
+            return True
+        return False
+
+    async def get_settings(self, attr):
+        info = self.get_info()
+        if attr in info:
+            return info[attr]
+
+        # some models only return settings at this endpoint
+        r = await self._request(f"/settings?q={attr}")
+        if not r:
+            return None
+
+        return self._store_setting(attr, self._json(r))
+
+    async def get_alerts(self):
+        r = await self._request("/query/alerts")
+        if r is False:
+            return r
+        return self._decode("alerts", r)["alerts"]
+
+    async def update_alerts(self):
+        self._set_alerts(await self.get_alerts())
+        if self.alerts:
+            return True
+        return False
+
+    async def parse_response(self, r, setting, update_info=False):
+        if r is False or r is None:
+            return False
+        try:
+            j = self._json(r)
+        except json.decoder.JSONDecodeError as error:
+            self.log.error("Failed to decode JSON: %s", error.msg)
+            return False
+        if "success" in j:
+            self.log.debug("{0} Success!".format(setting))
+            if update_info:
+                await self.update_info()
+            return True
+        else:
+            self.log.error("{0} Fail {1}.".format(setting, r.text))
+            return False
+
+    async def _lock_writes(self):
+        await self._write_lock.acquire()
+        self._begin_write(asyncio.current_task())
+
+    def _unlock_writes(self):
+        self._end_write()
+        self._write_lock.release()
+
+    def _current_writer(self):
+        return asyncio.current_task()
+
+    @_serialized
+    async def set_control(self, data):
+        r = await self._request("/control", data)
+        return await self.parse_response(r, 'set_control')
+
+    async def _write(self, path, fields, setting, update_info=False):
+        if self._batch is not None:
+            self._batch.add(path, fields, update_info)
+            return True
+        r = await self._request(path, urllib.parse.urlencode(fields))
+        if not self.optimistic:
+            return await self.parse_response(r, setting, update_info=update_info)
+        ok = await self.parse_response(r, setting)
+        if ok:
+            self._apply_written(fields)
+            self._schedule_verify()
+        return ok
+
+    def _schedule_verify(self):
+        if self._verify_handle is not None:
+            self._verify_handle.cancel()
+        self._verify_handle = asyncio.get_running_loop().call_later(self.verify_delay, self._start_verify)
+
+    def _start_verify(self):
+        self._verify_handle = asyncio.ensure_future(self._verify())
+
+    async def _verify(self):
+        if not await self.update_info():
+            self.log.warning("Failed to verify written settings on {0}".format(self.addr))
+        self._verify_handle = None
+
+    async def _flush_batch(self, batch):
+        plan = self._batch_plan(batch)
+        if plan is None:
+            self._info_valid = False
+            return False
+        for path, fields, setting in plan:
+            ok = await self._write(path, fields, setting)
+            batch.results.append((setting, ok))
+            if not ok:
+                break
+        if batch.refresh and not self.optimistic and any(ok for setting, ok in batch.results):
+            await self.update_info()
+        return all(ok for setting, ok in batch.results)
+
+    @_serialized
+    async def set_setpoints(self, heattemp, cooltemp):
+        fields = self._setpoints_fields(heattemp, cooltemp)
+        if fields is None:
+            return False
+        return await self._write("/control", fields, 'set_control')
+
+    @_serialized
+    async def set_mode(self, mode):
+        return await self._write("/control", self._mode_fields(mode), 'set_control')
+
+    @_serialized
+    async def set_fan(self, fan):
+        return await self._write("/control", self._fan_fields(fan), 'set_control')
+
+    @_serialized
+    async def set_settings(self):
+        fields = self._settings_fields()
+        if fields is None:
+            return False
+        return await self._write("/settings", fields, 'set_settings', update_info=True)
+
+    @_serialized
+    async def set_security(self, security):
+        if security not in [self.SECURITY_ON, self.SECURITY_OFF]:
+            return False
+        ret = await self._write("/settings", {'security': security}, 'set_security')
+        self.security = security
+        return ret
+
+    @_serialized
+    async def set_setpoint_limits(self, sp_max=None, sp_min=None):
+        if (sp_max == self.sp_max and sp_min == self.sp_min) or (sp_max is None and sp_min is None):
+            return True
+        # Make sure security is on
+        if self.security == 0:
+            await self.set_security(1)
+        fields = self._setpoint_limits_fields(sp_max, sp_min)
+        return await self._write("/settings", fields, 'set_setpoint_limits', update_info=True)
+
+    @_serialized
+    async def set_tempunits(self, tempunits):
+        self.tempunits = tempunits
+        return await self.set_settings()
+
+    @_serialized
+    async def set_away(self, away):
+        if not self._check_away():
+            return False
+
+        if self.away == away:
+            return True
+        if self.schedule == 1:
+            ret = await self.set_schedule(0)
+            if ret == False:
+                return ret
+        self.away = away
+        return await self._write("/settings", {'away':self.away}, 'set_away', update_info=True)
+
+    @_serialized
+    async def set_schedule(self, schedule):
+        if not self._check_schedule():
+            return False
+
+        if (self.schedule == schedule):
+            return True
+        #
+        # If thermostat is in away mode, then can't enable schedule.
+        #
+        if (self.away == 1):
+            return False
+        self.schedule = schedule
+        return await self._write("/settings", {'schedule':self.schedule}, 'set_schedule', update_info=True)
+
+    @_serialized
+    async def set_hum_setpoint(self, hum_setpoint):
+        if self.hum_setpoint is None:
+            self.log.warning("No humidifier support detected, ignoring set_hum_setpoint call!")
+            return False
+        self.hum_setpoint = hum_setpoint
+        return await self.set_settings()
+
+    @_serialized
+    async def set_dehum_setpoint(self, dehum_setpoint):
+        if self.dehum_setpoint is None:
+            self.log.warning("No dehumidification control support detected, ignoring set_dehum_setpoint call!")
+            return False
+        self.dehum_setpoint = dehum_setpoint
+        return await self.set_settings()
@@ -0,0 +1,210 @@
+import warnings
+
+import numpy as np
+
+from .runtimes import FIELDS, MISSING, RuntimeStore, _record_fields
+
+#
+# Vectorised analysis of runtime and sensor history for many thermostats.
+# Everything is computed on (devices x days) arrays instead of per-record
+# Python loops.  Needs numpy (pip install venstarcolortouch[analytics]).
+#
+DAY = 86400
+MINUTES_PER_DAY = 1440
+
+
+#
+# Runtime minutes for many thermostats on a common list of days:
+# ``minutes[device, day, field]``, NaN where a thermostat has no record for
+# that day.
+#
+class RuntimeTable:
+    def __init__(self, devices, days, fields, minutes):
+        self.devices = list(devices)
+        self.days = days
+        self.fields = tuple(fields)
+        self.minutes = minutes
+
+    def field(self, name):
+        return self.minutes[:, :, self.fields.index(name)]
+
+    #
+    # Sum of ``fields`` for every device and day (NaN where no record).
+    #
+    def total(self, fields):
+        columns = [self.fields.index(name) for name in fields if name in self.fields]
+        selected = self.minutes[:, :, columns]
+        total = np.nansum(selected, axis=2)
+        total[np.isnan(selected).all(axis=2)] = np.nan
+        return total
+
+    #
+    # Total minutes of each field over start <= day < end, as
+    # {device: {field: minutes}}.
+    #
+    def totals(self, start=None, end=None):
+        keep = np.ones(len(self.days), dtype=bool)
+        if start is not None:
+            keep &= self.days >= start
+        if end is not None:
+            keep &= self.days < end
+        sums = np.nansum(self.minutes[:, keep, :], axis=1)
+        return {device: dict(zip(self.fields, row.tolist())) for device, row in zip(self.devices, sums)}
+
+
+def _runtime_arrays(source):
+    if isinstance(source, RuntimeStore):
+        dtype = np.dtype([("ts", "<i8")] + [(field, "<i4") for field in source.fields])
+        data = np.fromfile(source.path, dtype=dtype, count=len(source), offset=source._offset)
+        # fields none of the records had are left out, as for lists of records
+        fields = tuple(field for field in source.fields if (data[field] != MISSING).any())
+        if not fields:
+            # a store with no records yet, e.g. for a device just added
+            return fields, data["ts"], np.empty((len(data), 0), dtype=np.int32)
+        values = np.stack([data[field] for field in fields], axis=1)
+        return fields, data["ts"], np.where(values == MISSING, 0, values)
+    records = list(source)
+    fields = _record_fields(records)
+    ts = np.array([record["ts"] for record in records], dtype=np.int64)
+    values = np.array([[record.get(field) or 0 for field in fields] for record in records],
+                      dtype=np.int64).reshape(len(records), len(fields))
+    return tuple(fields), ts, values
+
+
+#
+# Build a RuntimeTable from ``sources``, a dict of device key to a
+# RuntimeStore or a list of runtime records (as returned by
+# get_runtimes()).  RuntimeStores are read straight into arrays.
+#
+def load_runtimes(sources, start=None, end=None):
+    loaded = {key: _runtime_arrays(source) for key, source in sources.items()}
+    fields = [field for field in FIELDS if any(field in f for f, _, _ in loaded.values())]
+    fields += sorted({field for f, _, _ in loaded.values() for field in f} - set(fields))
+
+    stamps = [ts for _, ts, _ in loaded.values()]
+    days = np.unique(np.concatenate(stamps)) if stamps else np.empty(0, dtype=np.int64)
+    if start is not None:
+        days = days[days >= start]
+    if end is not None:
+        days = days[days < end]
+
+    minutes = np.full((len(loaded), len(days), len(fields)), np.nan)
+    for i, (source_fields, ts, values) in enumerate(loaded.values()):
+        index = np.searchsorted(days, ts)
+        keep = index < len(days)
+        keep[keep] = days[index[keep]] == ts[keep]
+        columns = [fields.index(field) for field in source_fields]
+        minutes[i, index[keep][:, None], columns] = values[keep]
+    return RuntimeTable(loaded.keys(), days, fields, minutes)
+
+
+#
+# Fraction of each day spent running ``fields`` (e.g. ("heat1",) or
+# ("cool1",)), per device and day.
+#
+def duty_cycle(table, fields):
+    return table.total(fields) / MINUTES_PER_DAY
+
+
+#
+# Mean of ``column`` of a SeriesStore (e.g. "Outdoor.temp") for each day
+# starting at ``days``; NaN for days without samples.
+#
+def daily_means(store, column, days):
+    days = np.asarray(days, dtype=np.int64)
+    means = np.full(len(days), np.nan)
+    if not len(days):
+        return means
+    ts, values = store.range(days[0], days[-1] + DAY, [column])
+    if column not in values or not len(ts):
+        return means
+    ts = np.frombuffer(ts, dtype=np.int64)
+    v = np.frombuffer(values[column], dtype=np.float64)
+    index = np.searchsorted(days, ts, side="right") - 1
+    keep = (index >= 0) & ~np.isnan(v)
+    keep[keep] &= ts[keep] < days[index[keep]] + DAY
+    sums = np.bincount(index[keep], weights=v[keep], minlength=len(days))
+    counts = np.bincount(index[keep], minlength=len(days))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means[:] = sums / counts
+    return means
+
+
+#
+# Daily mean of ``column`` for every device of a RuntimeTable, from
+# ``stores`` (device key -> SeriesStore).  Devices without a store are NaN.
+#
+def daily_series(table, stores, column="Outdoor.temp"):
+    out = np.full((len(table.devices), len(table.days)), np.nan)
+    for i, device in enumerate(table.devices):
+        if device in stores:
+            out[i] = daily_means(stores[device], column, table.days)
+    return out
+
+
+#
+# Heating and cooling degree days for daily mean temperatures.  ``base`` is
+# in the thermostat's units (65 for Fahrenheit, use 18 for Celsius).
+#
+def degree_days(temps, base=65.0):
+    temps = np.asarray(temps, dtype=np.float64)
+    return np.clip(base - temps, 0, None), np.clip(temps - base, 0, None)
+
+
+#
+# Row-wise Pearson correlation and least-squares slope of y against x over
+# the days where both are known.  Rows with fewer than three such days are
+# NaN.
+#
+def correlate(x, y):
+    x = np.atleast_2d(np.asarray(x, dtype=np.float64))
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    known = ~np.isnan(x) & ~np.isnan(y)
+    n = known.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = np.where(known, x, 0).sum(axis=1) / n
+        mean_y = np.where(known, y, 0).sum(axis=1) / n
+        dx = np.where(known, x - mean_x[:, None], 0)
+        dy = np.where(known, y - mean_y[:, None], 0)
+        cov = (dx * dy).sum(axis=1)
+        var_x = (dx * dx).sum(axis=1)
+        var_y = (dy * dy).sum(axis=1)
+        r = cov / np.sqrt(var_x * var_y)
+        slope = cov / var_x
+    r[n < 3] = np.nan
+    slope[n < 3] = np.nan
+    return r, slope
+
+
+#
+# How strongly each thermostat's runtime follows the weather: correlation
+# and minutes of runtime per degree day, for heating against heating degree
+# days and cooling against cooling degree days.
+#
+def weather_response(table, outdoor, base=65.0, heat_fields=("heat1",), cool_fields=("cool1",)):
+    hdd, cdd = degree_days(outdoor, base)
+    heat_r, heat_slope = correlate(hdd, table.total(heat_fields))
+    cool_r, cool_slope = correlate(cdd, table.total(cool_fields))
+    return {device: {"heat_r": float(heat_r[i]), "heat_per_degree_day": float(heat_slope[i]),
+                     "cool_r": float(cool_r[i]), "cool_per_degree_day": float(cool_slope[i])}
+            for i, device in enumerate(table.devices)}
+
+
+#
+# Flag outliers with the modified z-score (median and median absolute
+# deviation, which a few bad days can't drag along).  With axis=1 each
+# device is compared with its own history, with axis=0 each day is compared
+# across the fleet.  NaN is never flagged.
+#
+def anomalies(values, threshold=3.5, axis=1):
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        # nanmedian/nanmean warn about all-NaN rows, which are expected here
+        warnings.simplefilter("ignore", RuntimeWarning)
+        median = np.nanmedian(values, axis=axis, keepdims=True)
+        deviation = np.abs(values - median)
+        mad = np.nanmedian(deviation, axis=axis, keepdims=True)
+        # fall back to the mean absolute deviation when most values agree
+        mean_ad = np.nanmean(deviation, axis=axis, keepdims=True)
+        z = np.where(mad > 0, 0.6745 * deviation / mad, deviation / (1.253314 * mean_ad))
+    return np.nan_to_num(z, nan=0.0, posinf=np.inf) > threshold
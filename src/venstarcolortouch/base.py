@@ -0,0 +1,969 @@
+import json
+import logging
+import threading
+import time
+import zlib
+from types import MappingProxyType
+
+from .breaker import CircuitBreaker
+from .instrumentation import NO_INSTRUMENTATION
+from .state import (Mode, State, Fan, FanState, TempUnits, Security, Sched, SchedPart, Away,
+                    ThermostatState, SensorReading, ThermostatSnapshot)
+
+MIN_API_VER=3
+# Venstar developers fixed a bug for some models with the 5.28 firmware
+#   version. The new firmware correctly reports temperatures in the
+#   configured temperature unit.
+UNIT_BUG_FIX_VERSION = (5, 28)
+
+# orjson parses straight from bytes and several times faster than json
+# (pip install venstarcolortouch[speedups]).  It is looked for on the first
+# response rather than at import, which it would slow down.
+_json_loads = None
+
+def _get_loads():
+    global _json_loads
+    if _json_loads is None:
+        try:
+            from orjson import loads
+        except ImportError:
+            loads = json.loads
+        _json_loads = loads
+    return _json_loads
+
+# Runtime records are only updated once a day
+RUNTIMES_INTERVAL = 86400
+# The thermostat itself only keeps about a week of runtime records
+RUNTIMES_HISTORY = 7 * RUNTIMES_INTERVAL
+
+#
+# Settings that some models only return at /settings rather than /query/info.
+#
+SETTINGS_ATTRS = ("tempunits", "away", "schedule", "hum_setpoint", "dehum_setpoint")
+
+#
+# Threads fetching endpoints in a concurrent update(), and the default
+# connection pool size: enough for those plus info's settings fetched one
+# at a time, so no request in flight opens a connection that is thrown
+# away afterwards.
+#
+UPDATE_WORKERS = 8
+POOL_MAXSIZE = UPDATE_WORKERS + len(SETTINGS_ATTRS)
+
+_MISSING = object()
+
+
+# metrics label for a request path, e.g. "/settings" for "/settings?q=away"
+def _endpoint(path):
+    return path.split("?", 1)[0]
+
+
+def _keyed(endpoint, value):
+    if not value:
+        return {}
+    if endpoint == "sensors":
+        value = value.get("sensors") or []
+    if endpoint == "runtimes":
+        return {record.get("ts"): record for record in value}
+    if isinstance(value, list):
+        return {item.get("name"): item for item in value}
+    return value
+
+
+#
+# Collects set_* calls made inside ``with ct.batch():`` (``async with`` for
+# AsyncVenstarColorTouch) and sends them as the fewest legal requests when
+# the block ends, refreshing the info at most once.  ``ok`` and ``results``
+# (a list of (name, success) per request sent) are filled in on exit.  If the
+# block raises, nothing is sent.
+#
+class WriteBatch:
+    def __init__(self, ct):
+        self._ct = ct
+        self.control = {}
+        self.settings = {}
+        self.refresh = False
+        self.ok = None
+        self.results = []
+
+    def add(self, path, fields, update_info):
+        if path == "/control":
+            self.control.update(fields)
+        else:
+            self.settings.update(fields)
+        self.refresh = self.refresh or update_info
+
+    def _close(self, exc_type):
+        self._ct._batch = None
+        if exc_type is not None:
+            # set_* already changed the local copy; make the next update
+            # re-derive it from the thermostat
+            self._ct._info_valid = False
+            return False
+        return True
+
+    # The block holds the client's write lock, so set_* calls from other
+    # threads (or tasks) wait for it rather than joining the batch.
+    def _open(self):
+        if self._ct._batch is not None:
+            self._ct._unlock_writes()
+            raise RuntimeError("A write batch is already in progress")
+        self._ct._batch = self
+        return self
+
+    def __enter__(self):
+        self._ct._lock_writes()
+        return self._open()
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self._close(exc_type):
+                self.ok = self._ct._flush_batch(self)
+        finally:
+            self._ct._unlock_writes()
+
+    async def __aenter__(self):
+        await self._ct._lock_writes()
+        return self._open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if self._close(exc_type):
+                self.ok = await self._ct._flush_batch(self)
+        finally:
+            self._ct._unlock_writes()
+
+
+#
+# Everything that does not touch the network lives here so that the blocking
+# (VenstarColorTouch) and asyncio (AsyncVenstarColorTouch) clients share the
+# same login parsing, unit detection, sensor lookup and request validation.
+#
+class VenstarColorTouchBase:
+    #API Constants
+    MODE_OFF = Mode.OFF.value
+    MODE_HEAT = Mode.HEAT.value
+    MODE_COOL = Mode.COOL.value
+    MODE_AUTO = Mode.AUTO.value
+    STATE_IDLE = State.IDLE.value
+    STATE_HEATING = State.HEATING.value
+    STATE_COOLING = State.COOLING.value
+    STATE_LOCKOUT = State.LOCKOUT.value
+    STATE_ERROR = State.ERROR.value
+    FAN_AUTO = Fan.AUTO.value
+    FAN_ON = Fan.ON.value
+    FANSTATE_OFF = FanState.OFF.value
+    FANSTATE_ON = FanState.ON.value
+    TEMPUNITS_F = TempUnits.F.value
+    TEMPUNITS_C = TempUnits.C.value
+    SECURITY_OFF = Security.OFF.value
+    SECURITY_ON = Security.ON.value
+    SCHED_F = Sched.F.value
+    SCHED_C = Sched.C.value
+    SCHEDPART_MORNING = SchedPart.MORNING.value
+    SCHEDPART_DAY = SchedPart.DAY.value
+    SCHEDPART_EVENING = SchedPart.EVENING.value
+    SCHEDPART_NIGHT = SchedPart.NIGHT.value
+    SCHEDPART_INACTIVE = SchedPart.INACTIVE.value
+    AWAY_HOME = Away.HOME.value
+    AWAY_AWAY = Away.AWAY.value
+
+    sensor_names = { "Control": [ "Space Temp" ], "Local": [ "Thermostat" ] }
+    sensor_types = [ "Control", "Local", "Outdoor", "Remote", "Return", "Supply" ]
+
+    def __init__(self, addr, timeout, user=None, password=None, pin=None, proto='http', SSLCert=False,
+                 runtimes_store=None, optimistic=False, verify_delay=2.0, capability_cache=None,
+                 connect_timeout=None, breaker=None, instrumentation=None):
+        #Input parameters
+        self.addr = addr
+        self.timeout = timeout
+        # defaults to timeout; a short one lets unreachable thermostats fail fast
+        self.connect_timeout = connect_timeout
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.instrumentation = instrumentation if instrumentation is not None else NO_INSTRUMENTATION
+
+        #Use Python standard logging class
+        self.log = logging.getLogger(type(self).__module__)
+
+        #Preprocess authentication related parameters
+        if pin is not None:
+            self.pin = str(pin).zfill(4)
+        else:
+            self.pin = None
+
+        self.user = user
+        self.password = password
+        self.proto = proto
+        self.SSLCert = SSLCert
+
+        #Initialize State
+        self.status = {}
+        self.model = None
+        self._api_ver = None
+        self._type = None
+        self._info = None
+        self._state = None
+        self._sensors = None
+        # (readings, names, by name, by type), replaced as a whole
+        self._sensor_index = ((), [], {}, {})
+        self._firmware_ver = None
+        self.alerts = None
+        self.runtimes = None
+        self.runtimes_store = runtimes_store
+        # CapabilityCache that login() may be answered from
+        self.capability_cache = capability_cache
+        self._cached_tempunits = None
+        #
+        # In optimistic mode a successful write is applied to the local state
+        # straight away instead of re-reading /query/info; a single read
+        # verify_delay seconds after the last write reconciles any difference.
+        #
+        self.optimistic = optimistic
+        self.verify_delay = verify_delay
+        self._verify_handle = None
+        self._runtimes_next = None
+        self.update_results = {}
+
+        # endpoint -> (fingerprint, decoded json) of the last response
+        self._responses = {}
+        # False after a local write, so the next update re-derives everything
+        self._info_valid = False
+        self._observers = []
+        # the WriteBatch collecting set_* calls, if any
+        self._batch = None
+        #
+        # Readers are served from self._snapshot, which is replaced (under
+        # _publish_lock, never modified) by every update.  Writes to the
+        # thermostat are serialized per instance by the clients; _writes is
+        # bumped when the outermost one starts and again when it ends, so info
+        # fetched before or during a write can be told apart and dropped
+        # rather than undoing the write locally.
+        #
+        self._snapshot = ThermostatSnapshot()
+        self._publish_lock = threading.RLock()
+        self._writes = 0
+        self._writing = 0
+        self._writer = None
+        #
+        # /control
+        #
+        self.setpointdelta = None
+        self.heattemp = None
+        self.cooltemp = None
+        self.fan = None
+        self.mode = None
+        self.fanstate = None
+        self.state = None
+        #
+        # /settings
+        #
+        self.name = None
+        self.tempunits = None
+        self.away = None
+        self.schedule = None
+        self.hum_setpoint = None
+        self.dehum_setpoint = None
+        self.hum_active = None
+        self.security = None
+        self.sp_min = None
+        self.sp_max = None
+
+    def _uri(self, path):
+        # All calls to _request must have leading slash in path
+        return "{proto}://{addr}{path}".format(proto=self.proto, addr=self.addr, path=path)
+
+    #
+    # Called by _request() around every request so that a thermostat that
+    # can't be reached costs nothing until the circuit breaker lets a probe
+    # through, and is only logged about every breaker.log_interval seconds.
+    #
+    def _circuit_open(self, path, uri):
+        if self.breaker.allow():
+            return False
+        self.log.debug("Not requesting %s, %s is unreachable", uri, self.addr)
+        if self.instrumentation.enabled:
+            self.instrumentation.error(self.addr, _endpoint(path), "CircuitOpen")
+        return True
+
+    def _request_failed(self, path, uri, ex):
+        self.breaker.failure(ex)
+        if self.instrumentation.enabled:
+            self.instrumentation.error(self.addr, _endpoint(path), type(ex).__name__)
+        if self.breaker.should_log():
+            self.log.warning("Error requesting %s from Venstar ColorTouch: %s", uri, ex,
+                             exc_info=self.log.isEnabledFor(logging.DEBUG))
+
+    def _request_succeeded(self, path, method, start, r):
+        if self.breaker.success():
+            self.log.info("%s is reachable again", self.addr)
+        if self.instrumentation.enabled:
+            # every digest challenge answered along the way is in the history
+            challenges = sum(1 for prior in r.history if prior.status_code == 401)
+            self.instrumentation.request(self.addr, _endpoint(path), method, r.status_code,
+                                         time.perf_counter() - start, len(r.content), challenges)
+
+    def health(self):
+        health = self.breaker.health()
+        health["addr"] = self.addr
+        return health
+
+    def _params(self):
+        params = {}
+        if self.pin:
+            params['pin'] = self.pin
+        return params
+
+    def _parse_login(self, j):
+        if j["api_ver"] >= MIN_API_VER:
+            self._api_ver = j["api_ver"]
+            if "firmware" in j:
+                self._firmware_ver = tuple(map(int, j["firmware"].split(".")))
+            else:
+                self._firmware_ver = (0,0)
+            logging.debug("api_ver: %s" % self._api_ver)
+            self._type = j["type"]
+            if "model" in j:
+                self.model = j["model"]
+            else:
+                self.model = "COLORTOUCH"
+            return True
+        else:
+            self.log.error("Unsupported API version: %s", j["api_ver"])
+            return False
+
+    #
+    # Take the login() results from the capability cache instead of asking
+    # the thermostat.  Returns False if there is no usable entry.
+    #
+    def _login_cached(self):
+        if self.capability_cache is None:
+            return False
+        entry = self.capability_cache.get(self.addr)
+        if entry is None:
+            return False
+        self._api_ver = entry["api_ver"]
+        self._firmware_ver = tuple(entry["firmware"])
+        self._type = entry["type"]
+        self.model = entry["model"]
+        self._cached_tempunits = entry.get("tempunits")
+        profile = self._settings_profile()
+        profile["missing"].update(entry.get("settings_missing", ()))
+        if profile["batch"] is None:
+            profile["batch"] = entry.get("settings_batch")
+        self.log.debug("Using cached capabilities for %s", self.addr)
+        return True
+
+    def _remember_login(self):
+        if self.capability_cache is not None:
+            self.capability_cache.login(self.addr, self._api_ver, self._type, self.model, self._firmware_ver)
+
+    def _remember_capabilities(self):
+        if self.capability_cache is not None and self.tempunits is not None:
+            profile = self._settings_profile()
+            self.capability_cache.update(self.addr, tempunits=self.tempunits,
+                                         settings_missing=sorted(profile["missing"]),
+                                         settings_batch=profile["batch"])
+            self._cached_tempunits = self.tempunits
+
+    def _parse_info(self, info):
+        self._info = info
+
+        #
+        # Populate /control stuff
+        #
+        self.setpointdelta=info["setpointdelta"]
+        self.heattemp=info["heattemp"]
+        self.cooltemp=info["cooltemp"]
+        self.fan=info["fan"]
+        self.fanstate=info["fanstate"]
+        self.mode=info["mode"]
+        self.state=info["state"]
+
+        self.name = info["name"]
+
+    def _settings_attrs(self):
+        attrs = list(SETTINGS_ATTRS)
+        if self._type == "commercial":  #Commercial thermostats don't support "away"
+            attrs.remove("away")
+        return attrs
+
+    #
+    # What has been learned about the /settings endpoint of each model and
+    # firmware, shared by every instance talking to that kind of thermostat:
+    #   missing - settings reported neither in /query/info nor at /settings,
+    #             which are then never asked for again
+    #   batch   - whether /settings?q=a,b,c answers for several settings in one
+    #             request (None until known)
+    #
+    _settings_profiles = {}
+
+    def _settings_profile(self):
+        key = (self.model, self._firmware_ver)
+        profile = self._settings_profiles.get(key)
+        if profile is None:
+            profile = self._settings_profiles.setdefault(key, {"missing": set(), "batch": None})
+        return profile
+
+    def _settings_to_fetch(self, info):
+        missing = self._settings_profile()["missing"]
+        attrs = []
+        for attr in self._settings_attrs():
+            if attr in info:
+                continue
+            if attr in missing:
+                info[attr] = None
+            else:
+                attrs.append(attr)
+        return attrs
+
+    def _try_batch(self, attrs):
+        return len(attrs) > 1 and self._settings_profile()["batch"] is not False
+
+    #
+    # Settings to ask for one at a time after the batched query, whose
+    # answer is ``batched`` (None if it was not tried or failed).  Once
+    # batching is known to work its answer is complete; otherwise, or with
+    # a single setting to fetch, each setting is asked for on its own.
+    #
+    def _settings_rest(self, attrs, batched):
+        if batched is not None and self._settings_profile()["batch"] is True:
+            return []
+        return [attr for attr in attrs if batched is None or attr not in batched]
+
+    def _settings_query(self, attrs):
+        return "/settings?q={0}".format(",".join(attrs))
+
+    #
+    # Called by _fetch_settings() with the settings that were asked for, the
+    # answer to the batched query (None if it was not tried or failed),
+    # whether it was tried, and the individual answers (attr -> dict, or
+    # None if that request failed).  Updates the model's profile and returns
+    # the merged values.
+    #
+    def _learn_settings(self, attrs, batched, singles, tried=False):
+        profile = self._settings_profile()
+        if singles and self.instrumentation.enabled:
+            self.instrumentation.settings_fallback(self.addr, len(singles))
+        values = dict(batched or {})
+        answered = set()
+        for attr, j in singles.items():
+            if j is not None:
+                answered.add(attr)
+                if attr in j:
+                    values[attr] = j[attr]
+
+        if tried and batched is None and answered:
+            # It answers one setting at a time but rejected the batched
+            # query, so don't send that again
+            profile["batch"] = False
+        if batched is not None and profile["batch"] is None and values:
+            # Batching works if asking one at a time found nothing more
+            profile["batch"] = len(values) == len(batched)
+        if batched is not None and profile["batch"]:
+            answered.update(attrs)
+
+        for attr in answered:
+            if attr not in values:
+                profile["missing"].add(attr)
+                values[attr] = None
+        return values
+
+    def _store_setting(self, attr, r_json):
+        setting = r_json.get(attr)
+        with self._publish_lock:
+            # copied rather than changed in place; readers may hold the old one
+            info = dict(self._info)
+            info[attr] = setting
+            self._info = info
+            self._publish()
+        return setting
+
+    #
+    # Called once every settings attribute has been looked up (either in
+    # /query/info or at /settings) to finish populating /settings stuff.
+    #
+    def _parse_settings(self):
+        self.display_tempunits = self._info.get("tempunits")
+        if self._type != "commercial":
+            self.away = self._info.get("away")
+        self.schedule = self._info.get("schedule")
+        self.hum_setpoint = self._info.get("hum_setpoint")
+        self.dehum_setpoint = self._info.get("dehum_setpoint")
+        #
+        if "hum_active" in self._info:
+            self.hum_active = self._info["hum_active"]
+        else:
+            self.hum_active = 0
+        self.sp_min = self._info["cooltempmin"]
+        self.sp_max = self._info["heattempmax"]
+        self.tempunits = self._resolve_tempunits()
+        self._state = ThermostatState.from_info(self._info, tempunits=self.tempunits,
+                                                hum_active=self.hum_active)
+        self._remember_capabilities()
+
+    def _resolve_tempunits(self):
+        #
+        # T2xxx, T3xxx thermostats with firmware < 5.28 always use Celsius in the
+        # API regardless of the display units, so handle this case accordingly
+        if self.model.startswith(("T2", "T3")) and self.get_firmware_ver() < UNIT_BUG_FIX_VERSION:
+            # Always degC for firmware <= 5.28
+            logging.debug("Detected thermostat model %s, using temp units of Celsius", self.model)
+            return self.TEMPUNITS_C
+        elif (self.model in ["VYG-4900-VEN", "VYG-4800-VEN", "VYG-3800", "VYG-3900", "COLORTOUCH"] or
+              self.model.startswith(("T2", "T3"))):
+            # Same as display units
+            return self.display_tempunits
+        elif self._info["heattempmax"] >= 40:
+            # Heat max temp over 40, only possible if degF
+            if self._cached_tempunits != self.TEMPUNITS_F:
+                logging.warning("Unknown thermostat model %s, inferring API tempunits of Fahrenheit", self.model)
+            return self.TEMPUNITS_F
+        else:
+            if self._cached_tempunits != self.TEMPUNITS_C:
+                logging.warning("Unknown thermostat model %s, inferring API tempunits of Celsius", self.model)
+            return self.TEMPUNITS_C
+
+    #
+    # Merge the results of concurrently fetched endpoints into the local
+    # state in one go.  ``fetched`` maps endpoint name to the decoded payload
+    # (or False on failure); returns a dict of endpoint name to success.
+    # ``since`` is the _writes count from before the fetch (see _set_info()).
+    #
+    def _apply_updates(self, fetched, since=None):
+        results = {}
+        values = {}
+        for endpoint, value in fetched.items():
+            if endpoint in ("info", "sensors"):
+                if value is not False:
+                    values[endpoint] = value
+                results[endpoint] = value is not False
+            elif endpoint in ("alerts", "runtimes"):
+                values[endpoint] = value
+                results[endpoint] = bool(value)
+        self._merge(values, since)
+        return results
+
+    #
+    # Parse a response body.  Errors are json.JSONDecodeError (or a subclass)
+    # whichever parser is used.
+    #
+    def _json(self, r):
+        return _get_loads()(r.content)
+
+    #
+    # Decode a response, reusing the previous result for this endpoint if the
+    # body hasn't changed.  An unchanged body therefore yields the very same
+    # object, which the _set_*() functions below use to skip re-parsing.
+    #
+    def _decode(self, endpoint, r):
+        content = r.content
+        fingerprint = (len(content), zlib.crc32(content))
+        cached = self._responses.get(endpoint)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        if self.instrumentation.enabled:
+            start = time.perf_counter()
+            j = _get_loads()(content)
+            self.instrumentation.decode(self.addr, "/query/" + endpoint, time.perf_counter() - start,
+                                        len(content))
+        else:
+            j = _get_loads()(content)
+        self._responses[endpoint] = (fingerprint, j)
+        return j
+
+    #
+    # Write bookkeeping, called by the clients with their write lock held
+    # around every set_* call and batch.  ``writer`` identifies the thread
+    # (or task) doing the write, whose own refreshes are never dropped.
+    #
+    def _begin_write(self, writer):
+        with self._publish_lock:
+            if not self._writing:
+                self._writer = writer
+                self._writes += 1
+            self._writing += 1
+
+    def _end_write(self):
+        with self._publish_lock:
+            self._writing -= 1
+            if not self._writing:
+                self._writer = None
+                self._writes += 1
+
+    def _current_writer(self):
+        return threading.get_ident()
+
+    #
+    # Info fetched with ``since`` = _writes taken before the request is
+    # stale if a write has started or finished since, or another writer is
+    # still busy: it may predate a change that set_* already made locally.
+    #
+    def _stale(self, since):
+        if since != self._writes:
+            return True
+        return bool(self._writing) and self._writer != self._current_writer()
+
+    def _set_info(self, info, since=None):
+        self._merge({"info": info}, since)
+
+    def _set_sensors(self, sensors):
+        self._merge({"sensors": sensors})
+
+    def _set_alerts(self, alerts):
+        self._merge({"alerts": alerts})
+
+    def _set_runtimes(self, runtimes):
+        self._merge({"runtimes": runtimes})
+
+    #
+    # Take new values for one or more endpoints into the local state, publish
+    # a single snapshot holding all of them and only then call the
+    # observers, so neither readers nor callbacks see part of a poll.
+    #
+    def _merge(self, values, since=None):
+        changes = []
+        with self._publish_lock:
+            for endpoint, value in values.items():
+                if endpoint == "info":
+                    change = self._take_info(value, since)
+                elif endpoint == "sensors":
+                    change = self._take_sensors(value)
+                else:
+                    change = self._take_records(endpoint, value)
+                if change is not None:
+                    changes.append(change)
+            self._publish()
+        for endpoint, old, new in changes:
+            self._notify(endpoint, old, new)
+
+    def _publish(self):
+        info = self._info
+        self._snapshot = ThermostatSnapshot(MappingProxyType(info) if info is not None else None, self._state,
+                                            self._sensors, self._sensor_index[0], self.alerts, self.runtimes)
+
+    # The _take_*() helpers return (endpoint, old, new) to notify about, or None
+    def _take_info(self, info, since):
+        if since is not None and self._stale(since):
+            self.log.debug("Dropping info from %s that raced a write", self.addr)
+            return None
+        if self._info_valid and info == self._info:
+            return None
+        old = self._info
+        self._parse_info(info)
+        self._parse_settings()
+        self._info_valid = True
+        return "info", old, info
+
+    def _take_sensors(self, sensors):
+        if sensors is self._sensors:
+            return None
+        old = self._sensors
+        self._index_sensors(sensors)
+        self._sensors = sensors
+        return "sensors", old, sensors
+
+    # alerts and runtimes
+    def _take_records(self, endpoint, records):
+        old = getattr(self, endpoint)
+        setattr(self, endpoint, records)
+        if records is not False and records is not old:
+            return endpoint, old, records
+        return None
+
+    #
+    # Register callback(ct, endpoint, changes) to be called after an update
+    # that changed something.  ``changes`` only holds what changed since the
+    # previous poll: info keys, sensors and alerts by name, and runtime
+    # records by ts, mapped to their new value (None if it went away).
+    #
+    def on_change(self, callback):
+        self._observers.append(callback)
+        return callback
+
+    def remove_on_change(self, callback):
+        self._observers.remove(callback)
+
+    def _notify(self, endpoint, old, new):
+        if not self._observers:
+            return
+        old = _keyed(endpoint, old)
+        new = _keyed(endpoint, new)
+        changes = {key: value for key, value in new.items() if old.get(key, _MISSING) != value}
+        changes.update((key, None) for key in old if key not in new)
+        if not changes:
+            return
+        for callback in list(self._observers):
+            try:
+                callback(self, endpoint, changes)
+            except Exception:
+                self.log.exception("Error in on_change callback for {0}".format(endpoint))
+
+    #
+    # Runtime records only change once a day, so get_runtimes() serves the
+    # last download until the next day boundary (in the thermostat's own ts
+    # phase) has passed.  With a runtimes_store, a restarted process picks up
+    # where it left off instead of downloading the history again.
+    #
+    def _cached_runtimes(self):
+        if self.runtimes is None and self.runtimes_store is not None and self.runtimes_store.last_ts is not None:
+            last_ts = self.runtimes_store.last_ts
+            self.runtimes = self.runtimes_store.records(last_ts - RUNTIMES_HISTORY + RUNTIMES_INTERVAL)
+            self._runtimes_next = last_ts + RUNTIMES_INTERVAL
+        if self.runtimes and self._runtimes_next is not None and time.time() < self._runtimes_next:
+            return self.runtimes
+        return None
+
+    def _store_runtimes(self, runtimes):
+        if runtimes:
+            last_ts = max(record["ts"] for record in runtimes)
+            days = max(int((time.time() - last_ts) // RUNTIMES_INTERVAL), 0) + 1
+            self._runtimes_next = last_ts + days * RUNTIMES_INTERVAL
+            if self.runtimes_store is not None:
+                self.runtimes_store.append(runtimes)
+        return runtimes
+
+    #
+    # The ThermostatSnapshot published by the last updates.  Taking it never
+    # waits for a request in flight; read several values from one snapshot
+    # when they must agree with each other.
+    #
+    def snapshot(self):
+        return self._snapshot
+
+    # With no attr, returns a read-only view of the info dict rather than a copy
+    def get_info(self, attr=None):
+        info = self._snapshot.info
+        if attr is None:
+            return info
+        if info is None:
+            raise KeyError(attr)
+        return info[attr]
+
+    #
+    # Typed, read-only ThermostatState parsed from the last update_info(),
+    # or None before the first one.
+    #
+    def get_state(self):
+        return self._snapshot.state
+
+    #
+    # Tuple of SensorReading for every sensor from the last update_sensors().
+    #
+    def get_sensor_readings(self):
+        return self._snapshot.sensor_readings
+
+    def get_api_ver(self):
+        return self._api_ver
+
+    def get_firmware_ver(self):
+        return self._firmware_ver
+
+    def get_type(self):
+        return self._type
+
+    #
+    # Index the sensors once per /query/sensors response: name -> sensors with
+    # that name (normally just one) and type -> sensor names, including the
+    # types implied by well-known sensor names when the thermostat doesn't
+    # report one.
+    #
+    def _index_sensors(self, sensors):
+        names = []
+        readings = []
+        by_name = {}
+        by_type = {}
+        if sensors and sensors.get("sensors"):
+            for sensor in sensors["sensors"]:
+                if "name" not in sensor:
+                    continue
+                name = sensor["name"]
+                names.append(name)
+                by_name.setdefault(name, []).append(sensor)
+                types = []
+                if "type" in sensor:
+                    types.append(sensor["type"])
+                if name in self.sensor_types:
+                    types.append(name)
+                if name in self.sensor_names["Control"]:
+                    types.append("Control")
+                if name in self.sensor_names["Local"]:
+                    types.append("Local")
+                for type in dict.fromkeys(types):
+                    by_type.setdefault(type, []).append(name)
+                readings.append(SensorReading(name, sensor.get("type", self._sensor_type(name)),
+                                              sensor.get("temp"), sensor.get("hum"), sensor.get("battery")))
+        self._sensor_index = (tuple(readings), names, by_name, by_type)
+
+    def _sensor_type(self, name):
+        if name in self.sensor_types:
+            return name
+        elif name in self.sensor_names["Control"]:
+            return "Control"
+        elif name in self.sensor_names["Local"]:
+            return "Local"
+        return None
+
+    def get_sensor(self, name, attr):
+        return self._get_sensor(self._sensor_index, name, attr)
+
+    def _get_sensor(self, index, name, attr):
+        for sensor in index[2].get(name, ()):
+            # 'hum' (humidity) sensor is not present on T5800 series
+            if attr in sensor:
+                return sensor[attr]
+            elif attr == "type":
+                type = self._sensor_type(name)
+                if type is not None:
+                    return type
+        return None
+
+    def get_sensor_list(self, type=None):
+        index = self._sensor_index
+        if type is None:
+            return list(index[1])
+        return list(index[3].get(type, ()))
+
+    # Value of attr for the first sensor of the first of ``types`` present
+    def _first_sensor(self, attr, *types):
+        index = self._sensor_index
+        for type in types:
+            names = index[3].get(type)
+            if names:
+                return self._get_sensor(index, names[0], attr)
+        return None
+
+    def get_thermostat_sensor(self, attr):
+        return self._first_sensor(attr, "Local")
+
+    def get_outdoor_sensor(self, attr):
+        return self._first_sensor(attr, "Outdoor")
+
+    def get_indoor_temp(self):
+        return self._first_sensor("temp", "Control", "Local")
+
+    def get_outdoor_temp(self):
+        return self.get_outdoor_sensor("temp")
+
+    def get_indoor_humidity(self):
+        return self.get_thermostat_sensor("hum")
+
+    #
+    # The _*_fields() helpers validate a set_* call, update the local copy and
+    # return the fields to POST, or None if the call must not be sent.
+    #
+
+    # When setting MODE, you must also set heattemp/cooltemp.
+    # The set of legal operations is:
+    # When setting fan, only set fan.
+    # When setting heat/cool, set both heat cool and nothing else.
+    # When setting mode, set mode, heat and cool.
+
+    def _setpoints_fields(self, heattemp, cooltemp):
+        # Must not violate setpointdelta if we're in auto mode.
+        if self.mode == self.MODE_AUTO and heattemp + self.setpointdelta > cooltemp:
+            self.log.warning("In auto mode, the cool temp must be {0} "
+                  "degrees warmer than the heat temp.".format(self.setpointdelta))
+            return None
+        # Round to two decimal places because
+        # ColorTouch T8900 (and possibly others) throws "Both Setpoints are required"
+        # if a heat or cool temp with 3 decimal places or more is sent
+        self.heattemp = round(heattemp, 2)
+        self.cooltemp = round(cooltemp, 2)
+        return {'heattemp':self.heattemp, 'cooltemp':self.cooltemp}
+
+    def _mode_fields(self, mode):
+        self.mode = mode
+        return {'mode': self.mode, 'heattemp':self.heattemp, 'cooltemp':self.cooltemp}
+
+    def _fan_fields(self, fan):
+        self.fan = fan
+        return {'fan': self.fan}
+
+    def _settings_fields(self):
+        if self.tempunits is None:
+            self.log.error("update_info() must be called before settings may be set, aborting!")
+            return None
+        return {'tempunits':self.display_tempunits, 'hum_setpoint':self.hum_setpoint, 'dehum_setpoint':self.dehum_setpoint}
+
+    def _setpoint_limits_fields(self, sp_max, sp_min):
+        sp_limit_data = {}
+        if sp_max is not None:
+            sp_limit_data['spMax'] = sp_max
+        if sp_min is not None:
+            sp_limit_data['spMin'] = sp_min
+        return sp_limit_data
+
+    # Written field -> /query/info key, where they differ
+    _written_info_keys = {"spMax": "heattempmax", "spMin": "cooltempmin"}
+
+    def _apply_written(self, fields):
+        if self._info is None:
+            return
+        info = dict(self._info)
+        for key, value in fields.items():
+            if value is None or key == "security":
+                continue
+            info[self._written_info_keys.get(key, key)] = value
+        self._info_valid = False
+        self._set_info(info)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    #
+    # Turn the writes collected by a WriteBatch into the fewest requests that
+    # are still legal, in the order the thermostat needs them:
+    #   - one /control request for mode and/or setpoints (mode always goes
+    #     with both setpoints) and a separate one for the fan,
+    #   - the schedule is turned off before anything else in /settings and
+    #     turned on after everything else,
+    #   - security goes before the setpoint limits that need it,
+    #   - away gets its own request, like set_away().
+    # Returns a list of (path, fields, name), or None if the batch is invalid.
+    #
+    def _batch_plan(self, batch):
+        plan = []
+        control = batch.control
+        if "mode" in control or "heattemp" in control or "cooltemp" in control:
+            # Must not violate setpointdelta if we're in auto mode.
+            if self.mode == self.MODE_AUTO and self.heattemp + self.setpointdelta > self.cooltemp:
+                self.log.warning("In auto mode, the cool temp must be {0} "
+                      "degrees warmer than the heat temp.".format(self.setpointdelta))
+                return None
+            fields = {'heattemp':self.heattemp, 'cooltemp':self.cooltemp}
+            if "mode" in control:
+                fields = {'mode': self.mode, 'heattemp':self.heattemp, 'cooltemp':self.cooltemp}
+            plan.append(("/control", fields, 'set_control'))
+        if "fan" in control:
+            plan.append(("/control", {'fan': control["fan"]}, 'set_control'))
+
+        settings = dict(batch.settings)
+        schedule = settings.pop("schedule", None)
+        security = settings.pop("security", None)
+        away = settings.pop("away", None)
+        if schedule == 0:
+            plan.append(("/settings", {'schedule': schedule}, 'set_schedule'))
+        if security is not None:
+            plan.append(("/settings", {'security': security}, 'set_security'))
+        if settings:
+            plan.append(("/settings", settings, 'set_settings'))
+        if away is not None:
+            plan.append(("/settings", {'away': away}, 'set_away'))
+        if schedule is not None and schedule != 0:
+            plan.append(("/settings", {'schedule': schedule}, 'set_schedule'))
+        return plan
+
+    def _check_away(self):
+        if self.away is None:
+            self.log.error("update_info() must be called before away mode may be changed, aborting!")
+            return False
+        if not self._type.lower() == "residential":
+            self.log.error("Away mode is not supported on commercial thermostat models.")
+            return False
+        return True
+
+    def _check_schedule(self):
+        if self.schedule is None:
+            self.log.error("update_info() must be called before schedule state may be changed, aborting!")
+            return False
+        return True
@@ -0,0 +1,118 @@
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+#
+# Per-thermostat circuit breaker.  After ``failure_threshold`` consecutive
+# requests fail to reach the thermostat the circuit opens and requests fail
+# straight away for ``reset_timeout`` seconds.  The next request after that
+# is let through as a probe (half-open): if it succeeds the circuit closes,
+# otherwise it opens again for twice as long, up to ``max_reset_timeout``.
+#
+# Only failures to reach the thermostat count; an HTTP error status means it
+# is up.  should_log() rate-limits logging of those failures to one message
+# every ``log_interval`` seconds while the thermostat stays unreachable.
+#
+class CircuitBreaker:
+    def __init__(self, failure_threshold=3, reset_timeout=30, max_reset_timeout=600, log_interval=300):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.log_interval = log_interval
+
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.successes = 0
+        self.rejected = 0
+        self.suppressed = 0
+        self.last_error = None
+        self.last_failure = None
+        self.last_success = None
+        self.opened_at = None
+        self._timeout = reset_timeout
+        self._retry_at = 0.0
+        self._probing = False
+        self._logged_at = None
+
+    #
+    # Whether a request may be made now.
+    #
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self._retry_at:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    #
+    # Returns True if the thermostat had been failing.
+    #
+    def success(self):
+        with self._lock:
+            recovered = self.consecutive_failures > 0
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.successes += 1
+            self.last_success = time.time()
+            self.opened_at = None
+            self._timeout = self.reset_timeout
+            self._probing = False
+            self._logged_at = None
+            self.suppressed = 0
+            return recovered
+
+    def failure(self, error=None):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.failures += 1
+            self.last_error = error
+            self.last_failure = time.time()
+            if self.state == HALF_OPEN:
+                self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+                self._open()
+            elif self.state == CLOSED and self.failure_threshold and \
+                    self.consecutive_failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self._probing = False
+        self._retry_at = time.monotonic() + self._timeout
+        if self.opened_at is None:
+            self.opened_at = time.time()
+
+    def should_log(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._logged_at is None or now - self._logged_at >= self.log_interval:
+                self._logged_at = now
+                return True
+            self.suppressed += 1
+            return False
+
+    def health(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failures": self.failures,
+                "successes": self.successes,
+                "rejected": self.rejected,
+                "suppressed_logs": self.suppressed,
+                "last_error": None if self.last_error is None else str(self.last_error),
+                "last_failure": self.last_failure,
+                "last_success": self.last_success,
+                "opened_at": self.opened_at,
+                "retry_in": max(self._retry_at - time.monotonic(), 0.0) if self.state == OPEN else 0.0,
+            }
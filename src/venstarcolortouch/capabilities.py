@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+#
+# On-disk cache of what login() and update_info() discover about each
+# thermostat: api_ver, type, model and firmware from GET /, the API
+# temperature units resolved for the model, and which settings the model
+# reports only at /settings or not at all.  Clients given the cache start
+# warm without asking the thermostat again; an entry is re-probed once it is
+# older than max_age, and everything learned about settings is dropped when
+# the re-probe finds different firmware.
+#
+class CapabilityCache:
+    def __init__(self, path, max_age=7 * 86400):
+        self.path = path
+        self.max_age = max_age
+        self.log = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as error:
+                self.log.warning("Ignoring unreadable capability cache %s: %s", path, error)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, addr):
+        return addr in self._entries
+
+    #
+    # Cached entry for addr, or None if there isn't one or it is too old.
+    #
+    def get(self, addr):
+        entry = self._entries.get(addr)
+        if entry is None or time.time() - entry.get("checked", 0) > self.max_age:
+            return None
+        return entry
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".venstar-capabilities")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._entries, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    #
+    # Record the result of GET / for addr.  The file is only rewritten when
+    # the entry changed, or to move its check time forward once the saved
+    # one is half of max_age old, so logging many clients in that already
+    # have entries doesn't rewrite the whole cache for each of them.
+    #
+    def login(self, addr, api_ver, type, model, firmware):
+        with self._lock:
+            now = time.time()
+            old = self._entries.get(addr)
+            entry = {}
+            if old is not None and old.get("firmware") == list(firmware) and old.get("model") == model:
+                entry = {key: value for key, value in old.items() if key != "checked"}
+            entry.update({"api_ver": api_ver, "type": type, "model": model, "firmware": list(firmware)})
+            stale = old is None or now - old.get("checked", 0) > self.max_age / 2
+            changed = old is None or {key: value for key, value in old.items() if key != "checked"} != entry
+            entry["checked"] = now if changed or stale else old["checked"]
+            self._entries[addr] = entry
+            if changed or stale:
+                self._save()
+
+    #
+    # Record what update_info() learned; only written when it changed.
+    #
+    def update(self, addr, **capabilities):
+        with self._lock:
+            entry = self._entries.get(addr)
+            if entry is None:
+                return
+            changed = {key: value for key, value in capabilities.items() if entry.get(key) != value}
+            if changed:
+                entry.update(changed)
+                self._save()
+
+    def invalidate(self, addr=None):
+        with self._lock:
+            if addr is None:
+                removed = bool(self._entries)
+                self._entries.clear()
+            else:
+                removed = self._entries.pop(addr, None) is not None
+            if removed:
+                self._save()
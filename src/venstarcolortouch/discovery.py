@@ -0,0 +1,270 @@
+import logging
+import selectors
+import socket
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from .venstarcolortouch import VenstarColorTouch
+
+#
+# SSDP discovery as described in the Venstar local API documentation: an
+# M-SEARCH for ``venstar:thermostat:ecp`` is answered by every thermostat
+# with the local API enabled, with its URL in Location and its MAC address,
+# name and type in USN:
+#
+#   USN: ecp:00:23:a7:3a:b2:72:name:Living%20Room:type:residential
+#
+SSDP_ADDR = ("239.255.255.250", 1900)
+SEARCH_TARGET = "venstar:thermostat:ecp"
+
+
+def _m_search(mx):
+    return ("M-SEARCH * HTTP/1.1\r\n"
+            "HOST: 239.255.255.250:1900\r\n"
+            "MAN: \"ssdp:discover\"\r\n"
+            "MX: {0}\r\n"
+            "ST: {1}\r\n"
+            "\r\n").format(mx, SEARCH_TARGET).encode("ascii")
+
+
+def parse_ssdp(data):
+    lines = data.decode("utf-8", "replace").split("\r\n")
+    if not lines or not lines[0].startswith(("HTTP/1.1 200", "NOTIFY")):
+        return None
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    if headers.get("st", headers.get("nt")) != SEARCH_TARGET or "location" not in headers:
+        return None
+    return headers
+
+
+def _parse_usn(usn):
+    # ecp:<6 colon separated octets>:name:<name>:type:<type>
+    parts = usn.split(":")
+    fields = {}
+    if len(parts) >= 7 and parts[0] == "ecp":
+        fields["mac"] = ":".join(parts[1:7]).lower()
+        rest = parts[7:]
+        for key, value in zip(rest[::2], rest[1::2]):
+            fields[key] = urllib.parse.unquote(value)
+    return fields
+
+
+#
+# One thermostat found on the network.  ``addr`` and ``proto`` are what
+# VenstarColorTouch takes; model, api_ver, type and firmware come from the
+# thermostat's / endpoint when it was probed.
+#
+class DiscoveredThermostat:
+    def __init__(self, location, mac=None, name=None, type=None):
+        url = urllib.parse.urlsplit(location)
+        self.location = location
+        self.proto = url.scheme or "http"
+        self.addr = url.netloc
+        self.mac = mac
+        self.name = name
+        self.type = type
+        self.model = None
+        self.api_ver = None
+        self.firmware = None
+        self.last_seen = time.time()
+
+    # MAC address when known, since the address changes with DHCP
+    @property
+    def key(self):
+        return self.mac or self.addr
+
+    def client(self, timeout=5, **kwargs):
+        return VenstarColorTouch(self.addr, timeout, proto=self.proto, **kwargs)
+
+    def _asdict(self):
+        return {field: getattr(self, field) for field in ("addr", "proto", "location", "mac", "name", "type",
+                                                          "model", "api_ver", "firmware", "last_seen")}
+
+    def __repr__(self):
+        return "DiscoveredThermostat(addr={0!r}, mac={1!r}, name={2!r}, model={3!r}, api_ver={4!r})".format(
+            self.addr, self.mac, self.name, self.model, self.api_ver)
+
+
+def _probe(thermostat, timeout, client_kwargs):
+    with thermostat.client(timeout, **client_kwargs) as ct:
+        if not ct.login():
+            return False
+        thermostat.model = ct.model
+        thermostat.api_ver = ct.get_api_ver()
+        thermostat.type = ct.get_type()
+        thermostat.firmware = ".".join(map(str, ct.get_firmware_ver()))
+        return True
+
+
+#
+# Send an M-SEARCH to ``target`` and collect answers for ``timeout``
+# seconds, then (with probe=True) ask every thermostat found for its /
+# endpoint, all at once on ``max_workers`` threads.  Thermostats that don't
+# answer the probe are left out.  ``client_kwargs`` (e.g. user, password,
+# pin) are passed to the VenstarColorTouch used for probing.
+#
+def search(timeout=3.0, target=SSDP_ADDR, mx=2, interface=None, probe=True, probe_timeout=3.0,
+           max_workers=16, **client_kwargs):
+    log = logging.getLogger(__name__)
+    found = {}
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        if interface is not None:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+        message = _m_search(mx)
+        # UDP is lossy, so ask twice
+        sock.sendto(message, target)
+        sock.sendto(message, target)
+
+        deadline = time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            selector.register(sock, selectors.EVENT_READ)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if not selector.select(remaining):
+                    continue
+                try:
+                    data, sender = sock.recvfrom(4096)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                headers = parse_ssdp(data)
+                if headers is None:
+                    continue
+                fields = _parse_usn(headers.get("usn", ""))
+                thermostat = DiscoveredThermostat(headers["location"], fields.get("mac"), fields.get("name"),
+                                                  fields.get("type"))
+                found.setdefault(thermostat.key, thermostat)
+    finally:
+        sock.close()
+
+    thermostats = list(found.values())
+    if probe and thermostats:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(thermostats))) as executor:
+            results = list(executor.map(lambda t: _probe(t, probe_timeout, client_kwargs), thermostats))
+        for thermostat, ok in zip(thermostats, results):
+            if not ok:
+                log.warning("%s answered discovery but not the API", thermostat.location)
+        thermostats = [thermostat for thermostat, ok in zip(thermostats, results) if ok]
+    return thermostats
+
+
+#
+# Keeps a roster of the thermostats on the network by searching every
+# ``interval`` seconds in a background thread.  Thermostats not seen for
+# ``expire`` seconds are dropped.  With a ThermostatFleet, thermostats are
+# added to it as they appear (keyed by MAC address), re-added under their
+# new address when DHCP moves them, and removed when they expire.
+# on_found(thermostat) and on_lost(thermostat) are called for the same
+# events.
+#
+class DiscoveryMonitor:
+    def __init__(self, fleet=None, interval=300, expire=900, on_found=None, on_lost=None,
+                 client_timeout=5, client_kwargs=None, **search_kwargs):
+        self.fleet = fleet
+        self.interval = interval
+        self.expire = expire
+        self.on_found = on_found
+        self.on_lost = on_lost
+        self.client_timeout = client_timeout
+        self.client_kwargs = dict(client_kwargs or {})
+        self.search_kwargs = search_kwargs
+        self.log = logging.getLogger(__name__)
+        self._roster = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def roster(self):
+        with self._lock:
+            return dict(self._roster)
+
+    def _call(self, callback, thermostat):
+        if callback is not None:
+            try:
+                callback(thermostat)
+            except Exception:
+                self.log.exception("Error in discovery callback")
+
+    def _add(self, thermostat):
+        if self.fleet is not None:
+            self.fleet.add(thermostat.client(self.client_timeout, **self.client_kwargs), key=thermostat.key)
+
+    def _remove(self, thermostat):
+        if self.fleet is not None:
+            ct = self.fleet.remove(thermostat.key)
+            if ct is not None:
+                ct.close()
+
+    #
+    # Search once and update the roster.  Returns (found, lost) lists.
+    #
+    def scan(self):
+        kwargs = dict(self.client_kwargs)
+        kwargs.update(self.search_kwargs)
+        results = search(**kwargs)
+        now = time.time()
+        found = []
+        lost = []
+        moved = []
+        with self._lock:
+            for thermostat in results:
+                known = self._roster.get(thermostat.key)
+                if known is not None and known.addr == thermostat.addr:
+                    known.last_seen = now
+                    continue
+                if known is not None:
+                    self.log.info("%s moved from %s to %s", thermostat.key, known.addr, thermostat.addr)
+                    moved.append(known)
+                self._roster[thermostat.key] = thermostat
+                found.append(thermostat)
+            for key, thermostat in list(self._roster.items()):
+                if now - thermostat.last_seen > self.expire:
+                    del self._roster[key]
+                    lost.append(thermostat)
+        for thermostat in moved:
+            self._remove(thermostat)
+        for thermostat in lost:
+            self._remove(thermostat)
+            self._call(self.on_lost, thermostat)
+        for thermostat in found:
+            self._add(thermostat)
+            self._call(self.on_found, thermostat)
+        return found, lost
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.scan()
+            except Exception:
+                self.log.exception("Error during discovery")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="venstar-discovery", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,357 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+#
+# Default seconds between polls of each endpoint.  Runtimes only change once
+# a day so there is no point asking for them more often.
+#
+DEFAULT_INTERVALS = {"info": 60, "sensors": 30, "alerts": 300, "runtimes": 86400}
+
+
+#
+# What a bulk write remembers of each thermostat so it can be put back: the
+# local values set_* works from.  Security and temperature units are not
+# restored.
+#
+ROLLBACK_FIELDS = ("mode", "heattemp", "cooltemp", "fan", "away", "schedule", "hum_setpoint",
+                   "dehum_setpoint", "sp_max", "sp_min")
+
+# Written field -> ROLLBACK_FIELDS name, where they differ
+_ROLLBACK_KEYS = {"spMax": "sp_max", "spMin": "sp_min"}
+
+
+class _Refused(Exception):
+    pass
+
+
+#
+# The outcome of a bulk write on one device.  ``results`` is the
+# WriteBatch's list of (request, success), ``written`` the fields that were
+# queued, ``prior`` their values before the write and ``error`` why nothing
+# was sent ("unreachable", "refused" or an exception).  ``rolled_back`` is
+# None until a rollback has been tried.
+#
+class WriteResult:
+    def __init__(self, key):
+        self.key = key
+        self.ok = False
+        self.results = []
+        self.written = ()
+        self.prior = None
+        self.error = None
+        self.rolled_back = None
+
+    def __repr__(self):
+        return "WriteResult(key={0!r}, ok={1!r}, results={2!r}, error={3!r}, rolled_back={4!r})".format(
+            self.key, self.ok, self.results, self.error, self.rolled_back)
+
+
+#
+# Returned by ThermostatFleet.write(): ``devices`` maps each key to its
+# WriteResult.  rollback() puts the written fields back to what they were
+# before, e.g. when a demand response event ends.
+#
+class BulkWrite:
+    def __init__(self, fleet, devices):
+        self._fleet = fleet
+        self.devices = devices
+
+    @property
+    def ok(self):
+        return all(result.ok for result in self.devices.values())
+
+    @property
+    def failed(self):
+        return [key for key, result in self.devices.items() if not result.ok]
+
+    def rollback(self, keys=None, max_workers=None):
+        return self._fleet._rollback(self, keys, max_workers)
+
+
+class _Device:
+    def __init__(self, ct, intervals, now, jitter):
+        self.ct = ct
+        self.intervals = intervals
+        # Spread the first polls out so a freshly started fleet doesn't
+        # hit every thermostat in the same instant.
+        self.next_due = {endpoint: now + random.uniform(0, interval * jitter)
+                         for endpoint, interval in intervals.items()}
+        self.failures = 0
+        self.last_success = None
+        self.last_error = None
+        self.busy = False
+
+
+#
+# Polls many VenstarColorTouch instances on a bounded worker pool.  Every
+# device keeps its own per-endpoint schedule (see DEFAULT_INTERVALS), so e.g.
+# sensors can be polled every 30 seconds and runtimes once a day.  Devices
+# that fail are backed off exponentially up to backoff_max seconds.  With an
+# AdaptiveSchedule as ``schedule`` the intervals follow what each thermostat
+# is doing instead.
+#
+class ThermostatFleet:
+    def __init__(self, max_workers=16, intervals=None, jitter=0.1, backoff_base=30, backoff_max=3600,
+                 concurrent=False, schedule=None):
+        self.max_workers = max_workers
+        self.intervals = dict(DEFAULT_INTERVALS if intervals is None else intervals)
+        self.jitter = jitter
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # passed through to VenstarColorTouch.update()
+        self.concurrent = concurrent
+        self.schedule = schedule
+
+        self.log = logging.getLogger(__name__)
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="venstar-fleet")
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, ct, key=None, intervals=None):
+        if key is None:
+            key = ct.addr
+        merged = dict(self.intervals)
+        if intervals is not None:
+            merged.update(intervals)
+        with self._lock:
+            self._devices[key] = _Device(ct, merged, time.monotonic(), self.jitter)
+        return key
+
+    def remove(self, key):
+        with self._lock:
+            device = self._devices.pop(key, None)
+        return device.ct if device is not None else None
+
+    def get(self, key):
+        return self._devices[key].ct
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, key):
+        return key in self._devices
+
+    def _jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _poll_device(self, key, device, endpoints):
+        ct = device.ct
+        try:
+            # login() results are kept on the instance, so only the first
+            # poll (or one after a failed login) needs to ask again.
+            ok = ct.model is not None or ct.login()
+            if ok:
+                ok = ct.update(concurrent=self.concurrent,
+                               **{endpoint: endpoint in endpoints for endpoint in DEFAULT_INTERVALS})
+        except Exception as ex:
+            self.log.exception("Error polling %s", key)
+            device.last_error = ex
+            ok = False
+
+        now = time.monotonic()
+        intervals = device.intervals
+        if ok and self.schedule is not None:
+            intervals = self.schedule.intervals(ct, intervals, now)
+        with self._lock:
+            if ok:
+                device.failures = 0
+                device.last_success = time.time()
+                for endpoint, interval in intervals.items():
+                    due = now + self._jittered(interval)
+                    if endpoint in endpoints:
+                        device.next_due[endpoint] = due
+                    else:
+                        # an endpoint that has become more interesting is
+                        # brought forward rather than left on its old interval
+                        device.next_due[endpoint] = min(device.next_due[endpoint], due)
+            else:
+                device.failures += 1
+                delay = min(self.backoff_base * 2 ** (device.failures - 1), self.backoff_max)
+                self.log.debug("Poll of %s failed %d time(s), backing off %.0f seconds",
+                               key, device.failures, delay)
+                for endpoint in endpoints:
+                    device.next_due[endpoint] = now + self._jittered(delay)
+            device.busy = False
+        return ok
+
+    def _submit_due(self, now):
+        futures = {}
+        with self._lock:
+            for key, device in self._devices.items():
+                if device.busy:
+                    continue
+                endpoints = [endpoint for endpoint, due in device.next_due.items() if due <= now]
+                if endpoints:
+                    device.busy = True
+                    futures[key] = self._executor.submit(self._poll_device, key, device, endpoints)
+        return futures
+
+    #
+    # Poll every device that is due now and wait for them to finish.
+    # Returns a dict of key to success for the devices that were polled.
+    #
+    def poll_once(self):
+        futures = self._submit_due(time.monotonic())
+        return {key: future.result() for key, future in futures.items()}
+
+    def _next_wakeup(self):
+        with self._lock:
+            dues = [due for device in self._devices.values() if not device.busy
+                    for due in device.next_due.values()]
+        if not dues:
+            return 1.0
+        return min(max(min(dues) - time.monotonic(), 0.0), 1.0)
+
+    def run(self):
+        while not self._stop.is_set():
+            self._submit_due(time.monotonic())
+            self._stop.wait(self._next_wakeup())
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="venstar-fleet", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        self._executor.shutdown(wait=True)
+        for device in list(self._devices.values()):
+            device.ct.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Run work(key, ct) for each of ``cts`` on at most max_workers threads
+    def _each(self, cts, work, max_workers):
+        if not cts:
+            return
+        workers = min(max_workers or self.max_workers, len(cts))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="venstar-write") as executor:
+            list(executor.map(lambda item: work(*item), cts.items()))
+
+    def _clients(self, keys):
+        with self._lock:
+            if keys is None:
+                return {key: device.ct for key, device in self._devices.items()}
+            return {key: self._devices[key].ct for key in keys}
+
+    #
+    # Apply one change to many thermostats at once, on at most
+    # ``max_workers`` threads (default the fleet's).  change(ct) makes the
+    # set_* calls for one thermostat, e.g.
+    #
+    #   fleet.write(lambda ct: ct.set_setpoints(ct.heattemp, ct.cooltemp + 3))
+    #   fleet.write(lambda ct: ct.set_away(ct.AWAY_AWAY))
+    #
+    # It runs inside ct.batch(), so the set_* checks (setpointdelta in auto
+    # mode, schedule off before away...) apply as usual, the requests go out
+    # in the order the thermostat needs and the info is refreshed at most
+    # once.  If change() returns False nothing is sent to that thermostat.
+    # With rollback=True, a failure on any device rolls every device back.
+    #
+    def write(self, change, keys=None, max_workers=None, rollback=False):
+        cts = self._clients(keys)
+        bulk = BulkWrite(self, {key: WriteResult(key) for key in cts})
+        self._each(cts, lambda key, ct: self._write_device(key, ct, change, bulk.devices[key]), max_workers)
+        if rollback and not bulk.ok:
+            self.log.warning("Bulk write failed on %d of %d thermostats, rolling back",
+                             len(bulk.failed), len(bulk.devices))
+            bulk.rollback(max_workers=max_workers)
+        return bulk
+
+    def _write_device(self, key, ct, change, result):
+        try:
+            if ct.get_info() is None:
+                # set_* checks prerequisites against the current state
+                if not ((ct.model is not None or ct.login()) and ct.update_info()):
+                    result.error = "unreachable"
+                    return
+            with ct.batch() as batch:
+                result.prior = {field: getattr(ct, field) for field in ROLLBACK_FIELDS}
+                if change(ct) is False:
+                    raise _Refused()
+            result.written = tuple(batch.control) + tuple(batch.settings)
+            result.results = batch.results
+            result.ok = bool(batch.ok)
+        except _Refused:
+            result.error = "refused"
+        except Exception as ex:
+            self.log.exception("Error writing to %s", key)
+            result.error = ex
+
+    def _rollback(self, bulk, keys, max_workers):
+        results = bulk.devices if keys is None else {key: bulk.devices[key] for key in keys}
+        cts = {key: ct for key, ct in self._clients(None).items()
+               if key in results and results[key].written}
+        self._each(cts, lambda key, ct: self._undo_device(key, ct, results[key]), max_workers)
+        return all(results[key].rolled_back for key in cts)
+
+    def _undo_device(self, key, ct, result):
+        prior = result.prior
+        written = {_ROLLBACK_KEYS.get(field, field) for field in result.written}
+        try:
+            if not result.ok:
+                # part of the write may not have happened; start from the truth
+                ct.update_info()
+            with ct.batch() as undo:
+                # mode first, so the setpoints are checked against the old mode
+                if "mode" in written:
+                    ct.set_mode(prior["mode"])
+                if written & {"mode", "heattemp", "cooltemp"}:
+                    ct.set_setpoints(prior["heattemp"], prior["cooltemp"])
+                if "fan" in written:
+                    ct.set_fan(prior["fan"])
+                if "hum_setpoint" in written:
+                    ct.set_hum_setpoint(prior["hum_setpoint"])
+                if "dehum_setpoint" in written:
+                    ct.set_dehum_setpoint(prior["dehum_setpoint"])
+                if written & {"sp_max", "sp_min"}:
+                    ct.set_setpoint_limits(prior["sp_max"], prior["sp_min"])
+                # away before schedule: the schedule can't go on while away
+                if "away" in written:
+                    ct.set_away(prior["away"])
+                if written & {"away", "schedule"}:
+                    ct.set_schedule(prior["schedule"])
+            result.rolled_back = bool(undo.ok)
+        except Exception:
+            self.log.exception("Error rolling back %s", key)
+            result.rolled_back = False
+
+    #
+    # Latest known data for every device, keyed the same way as add().
+    #
+    def snapshot(self):
+        snap = {}
+        with self._lock:
+            devices = list(self._devices.items())
+        for key, device in devices:
+            ct = device.ct
+            # one client snapshot, so info, state and sensors agree
+            current = ct.snapshot()
+            snap[key] = {
+                "info": current.info,
+                "state": current.state,
+                "sensors": current.sensors["sensors"] if current.sensors else None,
+                "alerts": current.alerts,
+                "runtimes": current.runtimes,
+                "last_success": device.last_success,
+                "failures": device.failures,
+                "online": device.failures == 0 and device.last_success is not None,
+                "health": ct.health(),
+            }
+        return snap
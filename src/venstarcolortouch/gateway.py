@@ -0,0 +1,321 @@
+import argparse
+import json
+import logging
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .venstarcolortouch import VenstarColorTouch
+
+#
+# A local HTTP gateway that lets many consumers share one poll of each
+# thermostat.  Every device is served under its own prefix with the
+# thermostat's own paths, so an existing client only needs a new address:
+#
+#   gateway = Gateway({"living": VenstarColorTouch("192.168.1.10", 5, pin=1234)}, port=8080).start()
+#   ct = VenstarColorTouch("gateway-host:8080/living", 5)
+#
+# GETs of /, /query/* and /settings?q= are answered from a cache for
+# ttl[path] seconds; when several consumers miss at once only one request
+# goes to the thermostat and the others wait for its answer.  The
+# gateway's own clients carry the credentials and pin; whatever consumers
+# send for those is ignored.  So that anyone who can reach the gateway
+# can't change the thermostats without them, POSTs are refused unless
+# allow_writes is set; then POSTs to /control and /settings are passed
+# through, one at a time per device, and drop everything cached for that
+# device.
+#
+DEFAULT_TTL = {
+    "/": 3600,
+    "/query/info": 5,
+    "/query/sensors": 5,
+    "/query/alerts": 60,
+    "/query/runtimes": 3600,
+    "/settings": 5,
+}
+
+WRITE_PATHS = ("/control", "/settings")
+
+
+# a cached response and the fetch that is refilling it, if any
+class _Entry:
+    __slots__ = ("body", "fetched", "pending")
+
+    def __init__(self):
+        self.body = None
+        self.fetched = None
+        self.pending = None
+
+
+# one request to the thermostat that concurrent misses wait for
+class _Fetch:
+    __slots__ = ("done", "body")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.body = None
+
+
+#
+# ``devices`` maps the name used in the URL to a VenstarColorTouch.  If the
+# thermostat can't be reached, the last answer is served for up to
+# ``stale_if_error`` seconds past its ttl rather than failing.  Consumers
+# may only write through the gateway with ``allow_writes``.
+#
+class Gateway:
+    def __init__(self, devices, host="127.0.0.1", port=0, ttl=None, stale_if_error=300, allow_writes=False):
+        self.devices = dict(devices)
+        self.host = host
+        self.port = port
+        self.allow_writes = allow_writes
+        self.ttl = dict(DEFAULT_TTL)
+        if ttl:
+            self.ttl.update(ttl)
+        self.stale_if_error = stale_if_error
+        self.log = logging.getLogger(__name__)
+        # hits, misses (requests sent to thermostats), coalesced, stale, errors, writes
+        self.stats = dict.fromkeys(("hits", "misses", "coalesced", "stale", "errors", "writes"), 0)
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def _count(self, stat):
+        self.stats[stat] += 1
+
+    # The pin belongs to the gateway's client, so only keep q= (for /settings)
+    def _upstream_path(self, path, query):
+        q = urllib.parse.parse_qs(query).get("q")
+        if path == "/settings" and q:
+            return "/settings?q=" + ",".join(q)
+        return path
+
+    #
+    # Body of GET ``path`` on device ``name``, from the cache when it is
+    # fresh enough.  Returns (body, age in seconds), or None if the
+    # thermostat didn't answer and nothing usable is cached.
+    #
+    def get(self, name, path):
+        ct = self.devices[name]
+        ttl = self.ttl[path.split("?", 1)[0]]
+        key = (name, path)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                entry = self._cache[key] = _Entry()
+            now = time.monotonic()
+            if entry.body is not None and now - entry.fetched < ttl:
+                self._count("hits")
+                return entry.body, now - entry.fetched
+            fetch = entry.pending
+            owner = fetch is None
+            if owner:
+                fetch = entry.pending = _Fetch()
+                self._count("misses")
+            else:
+                self._count("coalesced")
+
+        if owner:
+            # whatever happens, the waiters must be let go and the next miss
+            # must fetch again; without a body they get the stale answer or
+            # an error
+            r = False
+            try:
+                r = ct._request(path)
+            except Exception:
+                self.log.exception("Fetching %s from %s failed", path, name)
+            finally:
+                with self._lock:
+                    if r is not False:
+                        fetch.body = r.content
+                        entry.body = fetch.body
+                        entry.fetched = time.monotonic()
+                    entry.pending = None
+                fetch.done.set()
+        else:
+            fetch.done.wait()
+
+        with self._lock:
+            if fetch.body is not None:
+                return fetch.body, 0.0
+            if entry.body is not None and time.monotonic() - entry.fetched < ttl + self.stale_if_error:
+                self._count("stale")
+                return entry.body, time.monotonic() - entry.fetched
+            self._count("errors")
+        return None
+
+    #
+    # Pass a write through to device ``name`` and drop its cached answers,
+    # whether or not the write worked.  Returns the thermostat's response
+    # body, or None if it didn't answer.
+    #
+    def post(self, name, path, body):
+        ct = self.devices[name]
+        ct._lock_writes()
+        try:
+            r = ct._request(path, body)
+        finally:
+            ct._unlock_writes()
+        self.invalidate(name)
+        with self._lock:
+            self._count("writes")
+            if r is False:
+                self._count("errors")
+                return None
+        return r.content
+
+    #
+    # Forget what is cached for device ``name`` (everything if None); fetches
+    # already in flight still answer the consumers waiting on them.
+    #
+    def invalidate(self, name=None):
+        with self._lock:
+            for key in list(self._cache):
+                if name is None or key[0] == name:
+                    del self._cache[key]
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.gateway = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="venstar-gateway", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._server.server_close()
+            self._server = None
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=()):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, reason):
+        self._send(status, {"error": True, "reason": reason})
+
+    # -> (device name, path on the thermostat, query string), or None
+    def _route(self):
+        url = urllib.parse.urlsplit(self.path)
+        name, sep, rest = url.path.lstrip("/").partition("/")
+        name = urllib.parse.unquote(name)
+        if name not in self.server.gateway.devices:
+            return None
+        return name, "/" + rest, url.query
+
+    def do_GET(self):
+        gateway = self.server.gateway
+        if urllib.parse.urlsplit(self.path).path == "/":
+            self._send(200, {"devices": sorted(gateway.devices), "stats": dict(gateway.stats)})
+            return
+        route = self._route()
+        if route is None:
+            self._error(404, "No such device")
+            return
+        name, path, query = route
+        if path not in gateway.ttl:
+            self._error(404, "Not found")
+            return
+        answer = gateway.get(name, gateway._upstream_path(path, query))
+        if answer is None:
+            self._error(502, "Thermostat did not answer")
+            return
+        body, age = answer
+        self._send(200, body, [("Age", str(int(age))),
+                               ("Cache-Control", "max-age={0}".format(gateway.ttl[path]))])
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length) if length else b""
+        route = self._route()
+        if route is None:
+            self._error(404, "No such device")
+            return
+        name, path, query = route
+        if path not in WRITE_PATHS:
+            self._error(404, "Not found")
+            return
+        if not self.server.gateway.allow_writes:
+            self._error(403, "Writes are not allowed through this gateway")
+            return
+        body = self.server.gateway.post(name, path, data)
+        if body is None:
+            self._error(502, "Thermostat did not answer")
+            return
+        self._send(200, body)
+
+
+#
+#   python -m venstarcolortouch.gateway --port 8080 living=192.168.1.10 office=192.168.1.11
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve many consumers from one poll of each thermostat.")
+    parser.add_argument("devices", nargs="+", metavar="NAME=ADDR", help="thermostat to serve under /NAME/")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--timeout", type=float, default=5)
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    parser.add_argument("--pin")
+    parser.add_argument("--proto", default="http")
+    parser.add_argument("--ttl", action="append", default=[], metavar="PATH=SECONDS",
+                        help="cache lifetime for a path, e.g. /query/info=10")
+    parser.add_argument("--allow-writes", action="store_true",
+                        help="pass POSTs to /control and /settings through to the thermostats")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    devices = {}
+    for device in args.devices:
+        name, sep, addr = device.partition("=")
+        if not sep:
+            parser.error("expected NAME=ADDR, got {0!r}".format(device))
+        devices[name] = VenstarColorTouch(addr, args.timeout, user=args.user, password=args.password,
+                                          pin=args.pin, proto=args.proto)
+    ttl = {}
+    for item in args.ttl:
+        path, sep, seconds = item.partition("=")
+        if not sep or path not in DEFAULT_TTL:
+            parser.error("expected one of {0}=SECONDS, got {1!r}".format(", ".join(DEFAULT_TTL), item))
+        ttl[path] = float(seconds)
+
+    gateway = Gateway(devices, host=args.host, port=args.port, ttl=ttl, allow_writes=args.allow_writes).start()
+    logging.getLogger(__name__).info("Serving %s on %s:%s", ", ".join(sorted(devices)), args.host, gateway.port)
+    try:
+        gateway._thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gateway.stop()
+        for ct in devices.values():
+            ct.close()
+
+
+if __name__ == "__main__":
+    main()
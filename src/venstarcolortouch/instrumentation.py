@@ -0,0 +1,201 @@
+import bisect
+import threading
+
+#
+# Hooks called on the request path.  The base class does nothing and has
+# ``enabled`` False, which the clients check before taking any timings, so
+# an uninstrumented client pays for one attribute lookup per request.
+# Subclass it (or use MetricsCollector) and pass it as ``instrumentation``.
+#
+#   request()           - a response was received; ``challenges`` is the
+#                         number of digest authentication 401s it took
+#   error()             - a request didn't get a response; ``kind`` is the
+#                         exception class name, or "CircuitOpen"
+#   decode()            - a response body was parsed as JSON
+#   settings_fallback() - ``count`` settings had to be asked for one at a
+#                         time at /settings
+#
+class Instrumentation:
+    enabled = False
+
+    def request(self, addr, endpoint, method, status, elapsed, size, challenges):
+        pass
+
+    def error(self, addr, endpoint, kind):
+        pass
+
+    def decode(self, addr, endpoint, elapsed, size):
+        pass
+
+    def settings_fallback(self, addr, count):
+        pass
+
+
+NO_INSTRUMENTATION = Instrumentation()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536)
+DECODE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                          for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+#
+# Instrumentation that keeps Prometheus style counters and histograms in
+# memory.  render() returns them in the Prometheus text format (or
+# OpenMetrics with openmetrics=True) and serve() exposes that over HTTP.
+# Metrics are labelled by endpoint; with per_device=True also by address.
+#
+class MetricsCollector(Instrumentation):
+    enabled = True
+
+    def __init__(self, per_device=False, prefix="venstar", latency_buckets=LATENCY_BUCKETS,
+                 size_buckets=SIZE_BUCKETS, decode_buckets=DECODE_BUCKETS):
+        self.per_device = per_device
+        self.prefix = prefix
+        self.latency_buckets = tuple(latency_buckets)
+        self.size_buckets = tuple(size_buckets)
+        self.decode_buckets = tuple(decode_buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.errors = {}
+            self.challenges = {}
+            self.fallbacks = {}
+            self.latency = {}
+            self.sizes = {}
+            self.decodes = {}
+
+    def _key(self, addr, *rest):
+        return ((addr,) if self.per_device else ()) + rest
+
+    def _observe(self, histograms, key, buckets, value):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = _Histogram(buckets)
+        histogram.observe(value)
+
+    def request(self, addr, endpoint, method, status, elapsed, size, challenges):
+        key = self._key(addr, endpoint, method)
+        with self._lock:
+            counter = key + (status,)
+            self.requests[counter] = self.requests.get(counter, 0) + 1
+            self._observe(self.latency, key, self.latency_buckets, elapsed)
+            self._observe(self.sizes, key, self.size_buckets, size)
+            if challenges:
+                self.challenges[key] = self.challenges.get(key, 0) + challenges
+
+    def error(self, addr, endpoint, kind):
+        key = self._key(addr, endpoint, kind)
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def decode(self, addr, endpoint, elapsed, size):
+        with self._lock:
+            self._observe(self.decodes, self._key(addr, endpoint), self.decode_buckets, elapsed)
+
+    def settings_fallback(self, addr, count):
+        key = self._key(addr)
+        with self._lock:
+            self.fallbacks[key] = self.fallbacks.get(key, 0) + count
+
+    def _counter(self, lines, name, help, names, values, openmetrics):
+        family = name[:-len("_total")] if openmetrics else name
+        lines.append("# HELP {0} {1}".format(family, help))
+        lines.append("# TYPE {0} counter".format(family))
+        for key, value in sorted(values.items()):
+            lines.append("{0}{1} {2}".format(name, _labels(names, key), value))
+
+    def _histogram(self, lines, name, help, names, histograms):
+        lines.append("# HELP {0} {1}".format(name, help))
+        lines.append("# TYPE {0} histogram".format(name))
+        for key, histogram in sorted(histograms.items()):
+            total = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                total += count
+                lines.append("{0}_bucket{1} {2}".format(name, _labels(names, key, [("le", _number(bound))]), total))
+            lines.append("{0}_sum{1} {2}".format(name, _labels(names, key), _number(histogram.sum)))
+            lines.append("{0}_count{1} {2}".format(name, _labels(names, key), histogram.count))
+
+    def render(self, openmetrics=False):
+        device = ("addr",) if self.per_device else ()
+        p = self.prefix
+        lines = []
+        with self._lock:
+            self._counter(lines, p + "_requests_total", "Responses received from thermostats.",
+                          device + ("endpoint", "method", "status"), self.requests, openmetrics)
+            self._counter(lines, p + "_request_errors_total", "Requests that got no response, by error type.",
+                          device + ("endpoint", "type"), self.errors, openmetrics)
+            self._counter(lines, p + "_digest_challenges_total", "Digest authentication 401 challenges.",
+                          device + ("endpoint", "method"), self.challenges, openmetrics)
+            self._counter(lines, p + "_settings_fallback_total", "Settings asked for one at a time at /settings.",
+                          device, self.fallbacks, openmetrics)
+            self._histogram(lines, p + "_request_duration_seconds", "Time taken by each request.",
+                            device + ("endpoint", "method"), self.latency)
+            self._histogram(lines, p + "_response_bytes", "Size of each response body.",
+                            device + ("endpoint", "method"), self.sizes)
+            self._histogram(lines, p + "_json_decode_seconds", "Time taken to parse each changed response.",
+                            device + ("endpoint",), self.decodes)
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    #
+    # Serve render() at http://host:port/metrics from a daemon thread.
+    # Returns the server; call shutdown() on it to stop.
+    #
+    def serve(self, port, host=""):
+        import http.server
+        collector = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+                body = collector.render(openmetrics).encode("utf-8")
+                self.send_response(200)
+                if openmetrics:
+                    self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+                else:
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="venstar-metrics", daemon=True).start()
+        return server
@@ -0,0 +1,303 @@
+import array
+import bisect
+import math
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+
+from .runtimes import RuntimeStore
+
+#
+# Columnar on-disk store of samples for one thermostat.
+#
+# A directory holding ``ts.i64`` (one little-endian int64 epoch second per
+# sample), ``columns`` (the series names, one per line) and ``<n>.f64`` for
+# series n (one little-endian float64 per sample, NaN where the series had
+# no value).  Every file is a flat array, so a range query is a binary
+# search of the memory-mapped timestamps followed by one slice per series.
+# A series only gets a file once it has a value (so a thermostat without a
+# humidity sensor has no ".hum" series), back-filled with NaN, and a sample
+# for the second that is already stored replaces it.
+#
+NAN = float("nan")
+
+_swap = sys.byteorder != "little"
+
+
+def _array(typecode, data):
+    values = array.array(typecode, data)
+    if _swap:
+        values.byteswap()
+    return values
+
+
+def _bytes(typecode, values):
+    values = array.array(typecode, values)
+    if _swap:
+        values.byteswap()
+    return values.tobytes()
+
+
+class SeriesStore:
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._files = {}
+
+        path = os.path.join(directory, "columns")
+        self.columns = []
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.columns = [line.rstrip("\n") for line in f if line.strip()]
+        self._index = {name: i for i, name in enumerate(self.columns)}
+
+        # An interrupted append can leave some files a sample longer than
+        # the timestamps; the timestamps are written last and decide.
+        self._ts_path = os.path.join(directory, "ts.i64")
+        if not os.path.exists(self._ts_path):
+            open(self._ts_path, "wb").close()
+        self._len = os.path.getsize(self._ts_path) // 8
+        for i in range(len(self.columns)):
+            path = self._column_path(i)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            self._len = min(self._len, size // 8)
+        for path in [self._ts_path] + [self._column_path(i) for i in range(len(self.columns))]:
+            with open(path, "r+b") as f:
+                f.truncate(self._len * 8)
+        self._last_ts = self._read_ts(self._len - 1) if self._len else None
+
+    def _column_path(self, index):
+        return os.path.join(self.directory, "%d.f64" % index)
+
+    def _file(self, path):
+        f = self._files.get(path)
+        if f is None:
+            f = self._files[path] = open(path, "r+b")
+        return f
+
+    def _read_ts(self, index):
+        f = self._file(self._ts_path)
+        f.seek(index * 8)
+        return _array("q", f.read(8))[0]
+
+    def close(self):
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def last_ts(self):
+        return self._last_ts
+
+    def _add_column(self, name):
+        index = len(self.columns)
+        with open(self._column_path(index), "wb") as f:
+            f.write(_bytes("d", [NAN] * self._len))
+        with open(os.path.join(self.directory, "columns"), "a", encoding="utf-8") as f:
+            f.write(name + "\n")
+        self.columns.append(name)
+        self._index[name] = index
+
+    #
+    # Store one sample: ``values`` maps series name to a number (or None).
+    # Samples older than the last one stored are ignored; returns whether
+    # the sample was stored.
+    #
+    def append(self, ts, values):
+        ts = int(ts)
+        with self._lock:
+            if self._last_ts is not None and ts < self._last_ts:
+                return False
+            for name, value in values.items():
+                if "\n" in name:
+                    raise ValueError("series names can't contain newlines: {0!r}".format(name))
+                if name not in self._index and value is not None and not math.isnan(value):
+                    self._add_column(name)
+            row = self._len - 1 if ts == self._last_ts else self._len
+            for name, index in self._index.items():
+                value = values.get(name)
+                f = self._file(self._column_path(index))
+                f.seek(row * 8)
+                f.write(_bytes("d", [NAN if value is None else float(value)]))
+                f.flush()
+            f = self._file(self._ts_path)
+            f.seek(row * 8)
+            f.write(_bytes("q", [ts]))
+            f.flush()
+            self._len = row + 1
+            self._last_ts = ts
+        return True
+
+    def _slice(self, path, typecode, lo, hi):
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return _array(typecode, m[lo * 8:hi * 8])
+
+    def _bounds(self, start, end):
+        if not self._len:
+            return 0, 0
+        with open(self._ts_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            view = memoryview(m)
+            try:
+                ts = view[:self._len * 8].cast("q") if not _swap else _array("q", view[:self._len * 8])
+                lo = 0 if start is None else bisect.bisect_left(ts, start)
+                hi = self._len if end is None else bisect.bisect_left(ts, end)
+            finally:
+                if not _swap:
+                    ts.release()
+                view.release()
+        return lo, hi
+
+    #
+    # Samples with start <= ts < end as (timestamps, {series: values}).
+    # The slices are copied out of the files into array.arrays, which numpy
+    # can then wrap without copying again.  ``columns`` limits which series
+    # are read.
+    #
+    def range(self, start=None, end=None, columns=None):
+        with self._lock:
+            lo, hi = self._bounds(start, end)
+            names = self.columns if columns is None else [name for name in columns if name in self._index]
+            if lo >= hi:
+                return array.array("q"), {name: array.array("d") for name in names}
+            ts = self._slice(self._ts_path, "q", lo, hi)
+            return ts, {name: self._slice(self._column_path(self._index[name]), "d", lo, hi) for name in names}
+
+    #
+    # Reduce samples to one value per ``step`` seconds (aligned to the
+    # epoch) using "mean", "min", "max" or "last", ignoring NaN.  Returns
+    # (bucket start times, {series: values}) as numpy arrays, with NaN for
+    # empty buckets of a series.  Needs numpy (pip install
+    # venstarcolortouch[analytics]).
+    #
+    def downsample(self, step, start=None, end=None, columns=None, how="mean"):
+        if how not in ("mean", "min", "max", "last"):
+            raise ValueError("Unknown downsampling function {0!r}".format(how))
+        import numpy as np
+        ts, values = self.range(start, end, columns)
+        ts = np.frombuffer(ts, dtype=np.int64)
+        if not len(ts):
+            return ts, {name: np.empty(0) for name in values}
+        # timestamps are sorted, so each bucket is one run of them
+        buckets = ts - ts % step
+        bounds = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+
+        reduced = {}
+        for name, column in values.items():
+            column = np.frombuffer(column, dtype=np.float64)
+            present = ~np.isnan(column)
+            if how == "mean":
+                counts = np.add.reduceat(present, bounds)
+                with np.errstate(invalid="ignore"):
+                    out = np.add.reduceat(np.where(present, column, 0.0), bounds) / counts
+            elif how == "min":
+                out = np.fmin.reduceat(column, bounds)
+            elif how == "max":
+                out = np.fmax.reduceat(column, bounds)
+            else:
+                last = np.maximum.reduceat(np.where(present, np.arange(len(column)), -1), bounds)
+                out = np.where(last >= 0, column[last], np.nan)
+            reduced[name] = out
+        return buckets[bounds], reduced
+
+
+#
+# Info fields recorded for every sample; sensors are recorded as
+# "<sensor name>.temp" and "<sensor name>.hum".
+#
+INFO_SERIES = ("spacetemp", "heattemp", "cooltemp", "hum", "mode", "state", "fan", "fanstate",
+               "schedulepart", "away")
+
+
+#
+# Records samples from any number of thermostats, one SeriesStore per
+# thermostat in a subdirectory of ``directory`` named after its address.
+# Runtime records go to a RuntimeStore alongside, unless the thermostat
+# already has a runtimes_store of its own.
+#
+class Recorder:
+    def __init__(self, directory, runtimes=True):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.runtimes = runtimes
+        self._lock = threading.Lock()
+        self._series = {}
+        self._runtime_stores = {}
+        self._watched = {}
+
+    def _name(self, addr):
+        return re.sub(r"[^A-Za-z0-9.-]", "_", addr)
+
+    def series(self, addr):
+        with self._lock:
+            store = self._series.get(addr)
+            if store is None:
+                store = self._series[addr] = SeriesStore(os.path.join(self.directory, self._name(addr)))
+            return store
+
+    def runtime_store(self, addr):
+        with self._lock:
+            store = self._runtime_stores.get(addr)
+            if store is None:
+                store = self._runtime_stores[addr] = RuntimeStore.for_thermostat(self.directory, addr)
+            return store
+
+    def _sample(self, ct):
+        values = {}
+        state = ct.get_state()
+        if state is not None:
+            for field in INFO_SERIES:
+                values[field] = getattr(state, field)
+        for reading in ct.get_sensor_readings():
+            values[reading.name + ".temp"] = reading.temp
+            values[reading.name + ".hum"] = reading.hum
+        return values
+
+    #
+    # Store the current state of ct as one sample taken at ``ts`` (default
+    # now), plus any new runtime records.
+    #
+    def record(self, ct, ts=None):
+        values = self._sample(ct)
+        if values:
+            self.series(ct.addr).append(time.time() if ts is None else ts, values)
+        if self.runtimes and ct.runtimes and ct.runtimes_store is None:
+            self.runtime_store(ct.addr).append(ct.runtimes)
+
+    def sample(self, cts, ts=None):
+        for ct in cts:
+            self.record(ct, ts)
+
+    def _on_change(self, ct, endpoint, changes):
+        if endpoint in ("info", "sensors", "runtimes"):
+            self.record(ct)
+
+    #
+    # Record ct every time an update brings in new info, sensors or runtimes.
+    #
+    def watch(self, ct):
+        self._watched[id(ct)] = ct.on_change(self._on_change)
+
+    def unwatch(self, ct):
+        callback = self._watched.pop(id(ct), None)
+        if callback is not None:
+            ct.remove_on_change(callback)
+
+    def close(self):
+        with self._lock:
+            for store in self._series.values():
+                store.close()
+            self._series.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,167 @@
+import bisect
+import os
+import re
+import struct
+import threading
+
+#
+# Append-only on-disk store of /query/runtimes records for one thermostat.
+#
+# The file starts with a small header naming the runtime fields, followed by
+# fixed-width little-endian records: an int64 ``ts`` and one int32 per field
+# (minutes of runtime for that day, MISSING if the record didn't have it).
+# Records are kept in ``ts`` order and a record for a day that is already
+# stored replaces it in place, so the thermostat's partial record for the
+# current day can be refreshed.
+#
+# Every numeric key of a record is stored, so records read back have the
+# same keys as the ones the thermostat sent.  A record with a key the file
+# doesn't have yet rewrites it with that field added.
+#
+MAGIC = b"VCTR"
+VERSION = 1
+FIELDS = ("heat1", "heat2", "cool1", "cool2", "aux1", "aux2", "fc")
+MISSING = -2 ** 31
+
+_header = struct.Struct("<4sBH")
+_ts = struct.Struct("<q")
+
+
+#
+# The numeric keys of ``records`` other than ts: FIELDS first, then any
+# others by name.
+#
+def _record_fields(records):
+    found = set()
+    for record in records:
+        for key, value in record.items():
+            if key != "ts" and isinstance(value, (int, float)) and not isinstance(value, bool):
+                found.add(key)
+    return tuple(field for field in FIELDS if field in found) + tuple(sorted(found - set(FIELDS)))
+
+
+class RuntimeStore:
+    def __init__(self, path, fields=FIELDS):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ts = []
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._load()
+        else:
+            self._create(path, tuple(fields))
+
+    def _create(self, path, fields):
+        self.fields = fields
+        self._record = struct.Struct("<q%di" % len(fields))
+        names = ",".join(fields).encode("ascii")
+        with open(path, "wb") as f:
+            f.write(_header.pack(MAGIC, VERSION, len(names)) + names)
+        self._offset = _header.size + len(names)
+
+    #
+    # Store for the thermostat at ``addr`` kept in ``directory``.
+    #
+    @classmethod
+    def for_thermostat(cls, directory, addr, fields=FIELDS):
+        os.makedirs(directory, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9.-]", "_", addr)
+        return cls(os.path.join(directory, name + ".runtimes"), fields)
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            magic, version, length = _header.unpack(f.read(_header.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("{0} is not a runtimes store".format(self.path))
+            self.fields = tuple(f.read(length).decode("ascii").split(","))
+            self._record = struct.Struct("<q%di" % len(self.fields))
+            self._offset = _header.size + length
+            data = f.read()
+        size = self._record.size
+        count = len(data) // size
+        self._ts = [_ts.unpack_from(data, i * size)[0] for i in range(count)]
+
+    def __len__(self):
+        return len(self._ts)
+
+    @property
+    def last_ts(self):
+        return self._ts[-1] if self._ts else None
+
+    def _pack(self, record):
+        return self._record.pack(int(record["ts"]), *(MISSING if field not in record else int(record[field] or 0)
+                                                      for field in self.fields))
+
+    #
+    # Rewrite the file with ``fields`` added, MISSING in the stored records.
+    # Called with the lock held.
+    #
+    def _widen(self, fields):
+        old_fields, old_record, old_offset = self.fields, self._record, self._offset
+        with open(self.path, "rb") as f:
+            f.seek(old_offset)
+            data = f.read(len(self._ts) * old_record.size)
+        tmp = self.path + ".tmp"
+        self._create(tmp, old_fields + fields)
+        with open(tmp, "ab") as f:
+            for i in range(len(self._ts)):
+                values = old_record.unpack_from(data, i * old_record.size)
+                f.write(self._record.pack(*(values + (MISSING,) * len(fields))))
+        os.replace(tmp, self.path)
+
+    #
+    # Add runtime records (dicts as returned by get_runtimes()).  Records
+    # older than the last stored one are ignored.  Returns the number of
+    # records written.
+    #
+    def append(self, records):
+        records = list(records)
+        with self._lock:
+            added = tuple(field for field in _record_fields(records) if field not in self.fields)
+            if added:
+                self._widen(added)
+            return self._write(records)
+
+    def _write(self, records):
+        written = 0
+        with open(self.path, "r+b") as f:
+            for record in sorted(records, key=lambda record: record["ts"]):
+                ts = int(record["ts"])
+                if self._ts and ts < self._ts[-1]:
+                    continue
+                if self._ts and ts == self._ts[-1]:
+                    f.seek(self._offset + (len(self._ts) - 1) * self._record.size)
+                else:
+                    f.seek(self._offset + len(self._ts) * self._record.size)
+                    self._ts.append(ts)
+                f.write(self._pack(record))
+                written += 1
+        return written
+
+    def _unpack(self, data, index):
+        values = self._record.unpack_from(data, index * self._record.size)
+        record = {field: value for field, value in zip(self.fields, values[1:]) if value != MISSING}
+        record["ts"] = values[0]
+        return record
+
+    #
+    # Records with start <= ts < end, oldest first.
+    #
+    def records(self, start=None, end=None):
+        lo = 0 if start is None else bisect.bisect_left(self._ts, start)
+        hi = len(self._ts) if end is None else bisect.bisect_left(self._ts, end)
+        if lo >= hi:
+            return []
+        with self._lock, open(self.path, "rb") as f:
+            f.seek(self._offset + lo * self._record.size)
+            data = f.read((hi - lo) * self._record.size)
+        return [self._unpack(data, i) for i in range(hi - lo)]
+
+    #
+    # Sum of each runtime field over start <= ts < end.
+    #
+    def totals(self, start=None, end=None):
+        totals = dict.fromkeys(self.fields, 0)
+        for record in self.records(start, end):
+            for field in self.fields:
+                totals[field] += record.get(field, 0)
+        return totals
@@ -0,0 +1,116 @@
+import threading
+import time
+import weakref
+
+from .state import Mode, State, FanState
+
+#
+# Poll intervals (seconds) for each activity level.  Endpoints not listed
+# keep the interval they would otherwise have (e.g. alerts and runtimes).
+#
+ACTIVE_INTERVALS = {"info": 15, "sensors": 15}
+WATCH_INTERVALS = {"info": 30, "sensors": 30}
+IDLE_INTERVALS = {"info": 300, "sensors": 120}
+
+
+class _Track:
+    def __init__(self):
+        self.status = None
+        self.changed = None
+        self.temps = {}
+        self.rate = 0.0
+
+
+#
+# Chooses poll intervals from what the thermostat is doing.  A thermostat is
+#   active - while heating, cooling or running the fan, and for ``hold``
+#            seconds after state, fanstate or schedulepart changed
+#   watch  - when the space temperature is within ``margin`` degrees of a
+#            setpoint that would start a cycle, or any sensor temperature is
+#            moving faster than ``rate`` degrees a minute
+#   idle   - otherwise
+# so an idle thermostat is asked rarely and a cycle starting or ending is
+# still seen quickly.  Pass one to ThermostatFleet as ``schedule``, or call
+# intervals() after each update() when polling by hand.
+#
+class AdaptiveSchedule:
+    def __init__(self, active=None, watch=None, idle=None, margin=1.0, rate=0.1, hold=300):
+        self.levels = {
+            "active": dict(ACTIVE_INTERVALS if active is None else active),
+            "watch": dict(WATCH_INTERVALS if watch is None else watch),
+            "idle": dict(IDLE_INTERVALS if idle is None else idle),
+        }
+        self.margin = margin
+        self.rate = rate
+        self.hold = hold
+        self._lock = threading.Lock()
+        self._tracks = weakref.WeakKeyDictionary()
+
+    def _observe(self, track, ct, now):
+        state = ct.get_state()
+        if state is not None:
+            status = (state.state, state.fanstate, state.schedulepart)
+            if status != track.status:
+                if track.status is not None:
+                    track.changed = now
+                track.status = status
+
+        temps = {reading.name: reading.temp for reading in ct.get_sensor_readings() if reading.temp is not None}
+        if state is not None and state.spacetemp is not None:
+            temps.setdefault("spacetemp", state.spacetemp)
+        rates = []
+        for name, temp in temps.items():
+            last = track.temps.get(name)
+            if last is not None and last[0] != temp and now > last[1]:
+                rates.append(abs(temp - last[0]) * 60 / (now - last[1]))
+            if last is None or last[0] != temp:
+                track.temps[name] = (temp, now)
+        if rates:
+            track.rate = max(rates)
+        elif track.temps and all(now - seen > 600 for _, seen in track.temps.values()):
+            # nothing has moved for ten minutes
+            track.rate = 0.0
+
+    def _near_setpoint(self, state):
+        if state.spacetemp is None:
+            return False
+        if state.mode in (Mode.HEAT, Mode.AUTO) and state.heattemp is not None:
+            if state.spacetemp <= state.heattemp + self.margin:
+                return True
+        if state.mode in (Mode.COOL, Mode.AUTO) and state.cooltemp is not None:
+            if state.spacetemp >= state.cooltemp - self.margin:
+                return True
+        return False
+
+    #
+    # Record the latest state of ct and return its activity level.
+    #
+    def level(self, ct, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            track = self._tracks.get(ct)
+            if track is None:
+                track = self._tracks[ct] = _Track()
+            self._observe(track, ct, now)
+
+        state = ct.get_state()
+        if state is None:
+            return "watch"
+        if state.state in (State.HEATING, State.COOLING) or state.fanstate == FanState.ON:
+            return "active"
+        if track.changed is not None and now - track.changed < self.hold:
+            return "active"
+        if self._near_setpoint(state) or track.rate >= self.rate:
+            return "watch"
+        return "idle"
+
+    #
+    # Poll intervals for ct, starting from ``defaults`` (endpoint -> seconds).
+    #
+    def intervals(self, ct, defaults, now=None):
+        intervals = dict(defaults)
+        for endpoint, interval in self.levels[self.level(ct, now)].items():
+            if endpoint in intervals:
+                intervals[endpoint] = interval
+        return intervals
@@ -0,0 +1,293 @@
+import logging
+import multiprocessing
+import struct
+import time
+from multiprocessing import shared_memory
+
+from .fleet import ThermostatFleet
+from .venstarcolortouch import VenstarColorTouch
+
+#
+# Values kept for every thermostat in a StateTable, all as float64 (NaN when
+# unknown).  Enum fields hold their integer value.
+#
+COLUMNS = ("spacetemp", "heattemp", "cooltemp", "hum", "outdoortemp", "hum_setpoint", "dehum_setpoint",
+           "mode", "state", "fanstate", "fan")
+
+MAGIC = b"VSTABLE1"
+KEY_SIZE = 44
+
+# magic, capacity, row size, number of columns
+_HEADER = struct.Struct("<8sIII")
+HEADER_SIZE = 64
+_SEQ = struct.Struct("<Q")
+# updated (epoch seconds), consecutive failures, key, then COLUMNS
+_DATA = struct.Struct("<di{0}s{1}d".format(KEY_SIZE, len(COLUMNS)))
+# rows are padded to whole cache lines so writers don't share them
+ROW_SIZE = -(-(_SEQ.size + _DATA.size) // 64) * 64
+
+NAN = float("nan")
+
+
+def _number(value):
+    if value is None:
+        return NAN
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+#
+# The latest state of many thermostats in one fixed-layout block of shared
+# memory, which any process can map and read without IPC or copying:
+#
+#   header (64 bytes): magic, capacity, row size, column count
+#   row (ROW_SIZE bytes each): sequence, updated, failures, key, COLUMNS
+#
+# Each row has a single writer and is guarded by a seqlock: the writer makes
+# the sequence odd, writes the row and makes it even again, and readers
+# retry if the sequence was odd or changed while they copied the row.  A
+# sequence of 0 means the row was never written.
+#
+# StateTable(capacity=n) creates a table, StateTable(name) attaches to one.
+# Processes that were not started from the creator (and so have their own
+# resource tracker) should attach with track=False, or the tracker removes
+# the table when they exit.
+#
+class StateTable:
+    def __init__(self, name=None, capacity=None, track=True):
+        if capacity is not None:
+            size = HEADER_SIZE + capacity * ROW_SIZE
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            _HEADER.pack_into(self._shm.buf, 0, MAGIC, capacity, ROW_SIZE, len(COLUMNS))
+            self.owner = True
+        else:
+            self._shm = _attach(name, track)
+            magic, capacity, row_size, columns = _HEADER.unpack_from(self._shm.buf, 0)
+            if magic != MAGIC or row_size != ROW_SIZE or columns != len(COLUMNS):
+                self._shm.close()
+                raise ValueError("{0} is not a StateTable of this version".format(name))
+            self.owner = False
+        self.name = self._shm.name
+        self.capacity = capacity
+        self._buf = self._shm.buf
+
+    def __len__(self):
+        return self.capacity
+
+    def _offset(self, row):
+        if not 0 <= row < self.capacity:
+            raise IndexError("row {0} out of range".format(row))
+        return HEADER_SIZE + row * ROW_SIZE
+
+    def _write(self, row, data):
+        offset = self._offset(row)
+        seq = _SEQ.unpack_from(self._buf, offset)[0]
+        _SEQ.pack_into(self._buf, offset, seq + 1)
+        _DATA.pack_into(self._buf, offset + _SEQ.size, *data)
+        _SEQ.pack_into(self._buf, offset, seq + 2)
+
+    def _read(self, row, retries=100):
+        offset = self._offset(row)
+        for attempt in range(retries):
+            seq = _SEQ.unpack_from(self._buf, offset)[0]
+            if seq == 0:
+                return None
+            if seq & 1:
+                time.sleep(0)
+                continue
+            data = _DATA.unpack_from(self._buf, offset + _SEQ.size)
+            if _SEQ.unpack_from(self._buf, offset)[0] == seq:
+                return data
+        raise RuntimeError("row {0} is being rewritten too often to read".format(row))
+
+    #
+    # Write the latest state of ``ct`` to ``row``.  Only the process that
+    # owns a row may write to it.
+    #
+    def publish(self, row, key, ct, failures=0):
+        state = ct.get_state()
+        values = [NAN] * len(COLUMNS)
+        if state is not None:
+            values = [_number(getattr(state, column, None)) for column in COLUMNS]
+            values[COLUMNS.index("outdoortemp")] = _number(ct.get_outdoor_temp())
+        self._write(row, (time.time(), failures, str(key).encode("utf-8")[:KEY_SIZE]) + tuple(values))
+
+    #
+    # Record a failed poll, keeping the last values and when they were read.
+    #
+    def failed(self, row, key, failures):
+        data = self._read(row)
+        if data is None:
+            data = (NAN, 0, b"") + (NAN,) * len(COLUMNS)
+        self._write(row, (data[0], failures, str(key).encode("utf-8")[:KEY_SIZE]) + data[3:])
+
+    def _record(self, data):
+        record = {"key": data[2].rstrip(b"\0").decode("utf-8", "replace"), "updated": data[0],
+                  "failures": data[1]}
+        record.update(zip(COLUMNS, data[3:]))
+        return record
+
+    #
+    # {"key", "updated", "failures", <COLUMNS>} for one row, or None if it
+    # was never written.
+    #
+    def read(self, row):
+        data = self._read(row)
+        return None if data is None else self._record(data)
+
+    #
+    # Every written row, each read consistently, as a list of read() dicts.
+    #
+    def scan(self):
+        records = []
+        for row in range(self.capacity):
+            data = self._read(row)
+            if data is not None:
+                records.append(self._record(data))
+        return records
+
+    #
+    # A numpy structured array over the rows, without copying.  It is not
+    # protected by the seqlock, so a row being written may be torn; use it
+    # for fleet-wide statistics and scan() when a row must be exact.  The
+    # array must be gone before close().
+    #
+    def as_array(self):
+        import numpy as np
+        dtype = np.dtype({"names": ["seq", "updated", "failures", "key"] + list(COLUMNS),
+                          "formats": ["<u8", "<f8", "<i4", "S{0}".format(KEY_SIZE)] + ["<f8"] * len(COLUMNS),
+                          "offsets": [0, 8, 16, 20] + [20 + KEY_SIZE + 8 * i for i in range(len(COLUMNS))],
+                          "itemsize": ROW_SIZE})
+        return np.frombuffer(self._buf, dtype=dtype, count=self.capacity, offset=HEADER_SIZE)
+
+    def close(self):
+        if self._shm is not None:
+            self._buf = None
+            self._shm.close()
+            self._shm = None
+
+    # Remove the table; processes that have it open keep their mapping
+    def unlink(self):
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _attach(name, track):
+    if track:
+        return shared_memory.SharedMemory(name=name)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13 there is no track argument
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+#
+# Body of one worker process: poll ``rows`` (a list of (row, addr)) with a
+# ThermostatFleet and publish every poll to the table until ``stop`` is set.
+#
+def _run_shard(table_name, rows, timeout, intervals, max_workers, client_kwargs, stop):
+    log = logging.getLogger(__name__)
+    table = StateTable(table_name)
+    fleet = ThermostatFleet(max_workers=max_workers, intervals=intervals)
+    addrs = {}
+    for row, addr in rows:
+        fleet.add(VenstarColorTouch(addr, timeout, **client_kwargs), key=row)
+        addrs[row] = addr
+    try:
+        while not stop.is_set():
+            for row, ok in fleet.poll_once().items():
+                failures = fleet._devices[row].failures
+                if ok:
+                    table.publish(row, addrs[row], fleet.get(row), failures)
+                else:
+                    table.failed(row, addrs[row], failures)
+            stop.wait(fleet._next_wakeup())
+    except Exception:
+        log.exception("Shard polling rows %s failed", [row for row, addr in rows])
+        raise
+    finally:
+        fleet.close()
+        table.close()
+
+
+#
+# Polls many thermostats from ``processes`` worker processes (default one
+# per CPU), each running a ThermostatFleet of ``max_workers`` threads over
+# its share of the devices, so JSON decoding and state derivation aren't
+# limited by one interpreter.  Results go to a StateTable with one row per
+# address, in the order given, which any process can scan:
+#
+#   with ShardedPoller(addrs, processes=4, pin=1234) as poller:
+#       ...
+#       for record in poller.table.scan():
+#           print(record["key"], record["spacetemp"], record["mode"])
+#
+# Only info and sensors are polled; extra keyword arguments (user,
+# password, pin, proto...) go to each VenstarColorTouch and must be
+# picklable.
+#
+class ShardedPoller:
+    def __init__(self, addrs, processes=None, timeout=5, intervals=None, max_workers=16, name=None,
+                 context=None, **client_kwargs):
+        self.addrs = list(addrs)
+        self.processes = max(1, min(processes or multiprocessing.cpu_count(), len(self.addrs) or 1))
+        self.timeout = timeout
+        self.intervals = dict(intervals or {"info": 60, "sensors": 30})
+        self.max_workers = max_workers
+        self.client_kwargs = client_kwargs
+        # spawn, because the parent may already be running threads
+        self._context = context or multiprocessing.get_context("spawn")
+        self.table = StateTable(name, capacity=max(len(self.addrs), 1))
+        self.rows = {addr: row for row, addr in enumerate(self.addrs)}
+        self._stop = None
+        self._workers = []
+
+    def start(self):
+        if self._workers:
+            return self
+        self._stop = self._context.Event()
+        rows = list(enumerate(self.addrs))
+        for shard in range(self.processes):
+            worker = self._context.Process(target=_run_shard, name="venstar-shard-{0}".format(shard),
+                                           args=(self.table.name, rows[shard::self.processes], self.timeout,
+                                                 self.intervals, self.max_workers, self.client_kwargs,
+                                                 self._stop),
+                                           daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return self
+
+    def stop(self, timeout=10):
+        if self._stop is not None:
+            self._stop.set()
+        for worker in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        self._workers = []
+
+    def read(self, addr):
+        return self.table.read(self.rows[addr])
+
+    def close(self):
+        self.stop()
+        self.table.unlink()
+        self.table.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
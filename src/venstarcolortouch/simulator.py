@@ -0,0 +1,517 @@
+import collections
+import hashlib
+import json
+import os
+import selectors
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#
+# In-process stand-in for a ColorTouch thermostat, for exercising and
+# benchmarking the library without real hardware.  It implements the parts of
+# the local API the library uses (/, /query/info, /query/sensors,
+# /query/alerts, /query/runtimes, /settings and /control), plus optional
+# latency, digest authentication, a PIN and some model/firmware quirks.
+#
+#   sim = SimulatedThermostat(model="T7900", latency=0.05)
+#   sim.start()
+#   ct = VenstarColorTouch(sim.addr, timeout=5)
+#   ...
+#   sim.stop()
+#
+
+DEFAULT_INFO = {
+    "name": "Simulated",
+    "mode": 1,
+    "state": 0,
+    "fan": 0,
+    "fanstate": 0,
+    "tempunits": 0,
+    "schedule": 0,
+    "schedulepart": 255,
+    "away": 0,
+    "spacetemp": 70.0,
+    "heattemp": 68.0,
+    "cooltemp": 75.0,
+    "cooltempmin": 35.0,
+    "cooltempmax": 99.0,
+    "heattempmin": 35.0,
+    "heattempmax": 99.0,
+    "setpointdelta": 2.0,
+    "hum": 40,
+    "hum_setpoint": 30,
+    "dehum_setpoint": 60,
+    "hum_active": 0,
+    "availablemodes": 0,
+}
+
+DEFAULT_SENSORS = [
+    {"name": "Thermostat", "temp": 70.0, "hum": 40},
+    {"name": "Outdoor", "temp": 45.0},
+    {"name": "Remote", "temp": 69.0, "battery": 100, "type": "Remote"},
+]
+
+TEMP_FIELDS = ("spacetemp", "heattemp", "cooltemp", "cooltempmin", "cooltempmax",
+               "heattempmin", "heattempmax")
+SETTINGS_FIELDS = ("tempunits", "away", "schedule", "hum_setpoint", "dehum_setpoint")
+
+# Same cut-off as the client: older T2xxx/T3xxx firmware always talks Celsius
+UNIT_BUG_FIX_VERSION = (5, 28)
+
+
+def _to_c(f):
+    return round((f - 32) * 5 / 9, 1)
+
+
+def _to_f(c):
+    return round(c * 9 / 5 + 32, 1)
+
+
+def _runtimes(days, now=None):
+    now = time.time() if now is None else now
+    today = int(now) - int(now) % 86400
+    return [{"ts": today - 86400 * day, "heat1": 60 + day, "heat2": 0, "cool1": 30 + day,
+             "cool2": 0, "aux1": 0, "aux2": 0, "fc": 0}
+            for day in range(days - 1, -1, -1)]
+
+
+class SimulatedThermostat:
+    def __init__(self, host="127.0.0.1", port=0, model="COLORTOUCH", firmware="6.01", api_ver=7,
+                 type="residential", info=None, sensors=None, alerts=None, runtime_days=7,
+                 settings_only=(), batch_settings=True, latency=0.0, user=None, password=None,
+                 pin=None, realm="Venstar", mac=None):
+        self.host = host
+        self.port = port
+        self.model = model
+        self.firmware = firmware
+        self.api_ver = api_ver
+        self.type = type
+        self.info = dict(DEFAULT_INFO)
+        if type == "commercial":
+            del self.info["away"]
+        if info:
+            self.info.update(info)
+        # settings_only: settings served at /settings but not in /query/info
+        self.settings_only = set(settings_only)
+        # batch_settings: whether /settings?q=a,b answers for every key
+        self.batch_settings = batch_settings
+        self.sensors = [dict(sensor) for sensor in (DEFAULT_SENSORS if sensors is None else sensors)]
+        self.alerts = list(alerts) if alerts is not None else [
+            {"name": "Air Filter", "active": False},
+            {"name": "UV Lamp", "active": False},
+            {"name": "Service", "active": False},
+        ]
+        self.runtimes = _runtimes(runtime_days)
+        self.security = 0
+        self.latency = latency
+        self.user = user
+        self.password = password
+        self.pin = None if pin is None else str(pin).zfill(4)
+        self.realm = realm
+        self._mac = mac
+
+        self.requests = collections.Counter()
+        self.connections = 0
+        self.challenges = 0
+        self._nonces = set()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def addr(self):
+        return "{0}:{1}".format(self.host, self.port)
+
+    # made up from the port unless one was given
+    @property
+    def mac(self):
+        if self._mac is not None:
+            return self._mac
+        return "00:23:a7:00:{0:02x}:{1:02x}".format(self.port >> 8, self.port & 0xff)
+
+    #
+    # True when this model/firmware reports temperatures in Celsius whatever
+    # the display units are.
+    #
+    @property
+    def celsius_quirk(self):
+        firmware = tuple(map(int, self.firmware.split(".")))
+        return self.model.startswith(("T2", "T3")) and firmware < UNIT_BUG_FIX_VERSION
+
+    def _api_celsius(self):
+        return self.celsius_quirk and self.info.get("tempunits") == 0
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests.clear()
+            self.connections = 0
+            self.challenges = 0
+
+    @property
+    def request_count(self):
+        return sum(self.requests.values())
+
+    def _server_bind(self):
+        server = _Server((self.host, self.port), _Handler)
+        server.thermostat = self
+        self.port = server.server_address[1]
+        self._server = server
+        return server
+
+    def start(self):
+        server = self._server_bind()
+        self._thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.1},
+                                        name="venstar-sim-{0}".format(self.port), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        if self._server is not None:
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    #
+    # Request handling, called from the handler threads.
+    #
+
+    def _root(self):
+        return {"api_ver": self.api_ver, "type": self.type, "model": self.model,
+                "firmware": self.firmware}
+
+    def _query_info(self):
+        info = {key: value for key, value in self.info.items() if key not in self.settings_only}
+        if self._api_celsius():
+            for field in TEMP_FIELDS:
+                if field in info:
+                    info[field] = _to_c(info[field])
+            info["setpointdelta"] = round(info["setpointdelta"] * 5 / 9, 1)
+        return info
+
+    def _query_sensors(self):
+        sensors = [dict(sensor) for sensor in self.sensors]
+        if self._api_celsius():
+            for sensor in sensors:
+                if "temp" in sensor:
+                    sensor["temp"] = _to_c(sensor["temp"])
+        return {"sensors": sensors}
+
+    def _query_settings(self, query):
+        keys = [key for key in query.split(",") if key]
+        if not self.batch_settings:
+            keys = keys[:1]
+        return {key: self.info[key] for key in keys if key in SETTINGS_FIELDS and key in self.info}
+
+    def _error(self, reason):
+        return {"error": True, "reason": reason}
+
+    def _control(self, form):
+        fields = {key: values[0] for key, values in form.items()}
+        if "fan" in fields:
+            if len(fields) != 1:
+                return self._error("Fan must be set on its own")
+            self.info["fan"] = int(float(fields["fan"]))
+            self.info["fanstate"] = self.info["fan"]
+            return {"success": True}
+        if "heattemp" not in fields or "cooltemp" not in fields:
+            return self._error("Both Setpoints are required")
+        try:
+            heattemp = float(fields["heattemp"])
+            cooltemp = float(fields["cooltemp"])
+        except ValueError:
+            return self._error("Both Setpoints are required")
+        if len(fields["heattemp"].partition(".")[2]) > 2 or len(fields["cooltemp"].partition(".")[2]) > 2:
+            return self._error("Both Setpoints are required")
+        if self._api_celsius():
+            heattemp, cooltemp = _to_f(heattemp), _to_f(cooltemp)
+        mode = int(float(fields.get("mode", self.info["mode"])))
+        if mode not in (0, 1, 2, 3):
+            return self._error("Invalid mode")
+        if mode == 3 and heattemp + self.info["setpointdelta"] > cooltemp:
+            return self._error("Setpoints violate setpointdelta")
+        self.info["mode"] = mode
+        self.info["heattemp"] = heattemp
+        self.info["cooltemp"] = cooltemp
+        return {"success": True}
+
+    def _settings(self, form):
+        fields = {key: values[0] for key, values in form.items()}
+        if self.info.get("schedule") == 1 and "away" in fields:
+            return self._error("Away can't be changed while the schedule is on")
+        for key, value in fields.items():
+            if key in SETTINGS_FIELDS:
+                if value == "None":
+                    continue
+                if key == "away" and "away" not in self.info:
+                    return self._error("Away is not supported")
+                self.info[key] = int(float(value))
+            elif key == "security":
+                self.security = int(value)
+            elif key in ("spMax", "spMin"):
+                if not self.security:
+                    return self._error("Security must be on to set setpoint limits")
+                self.info["heattempmax" if key == "spMax" else "cooltempmin"] = float(value)
+            else:
+                return self._error("Unknown setting {0}".format(key))
+        return {"success": True}
+
+    def handle(self, method, path, query, body):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests[path if method == "GET" else "{0} {1}".format(method, path)] += 1
+            if self.pin is not None and query.get("pin", [None])[0] != self.pin:
+                return 403, self._error("Invalid PIN")
+            if method == "GET":
+                if path == "/":
+                    return 200, self._root()
+                elif path == "/query/info":
+                    return 200, self._query_info()
+                elif path == "/query/sensors":
+                    return 200, self._query_sensors()
+                elif path == "/query/alerts":
+                    return 200, {"alerts": self.alerts}
+                elif path == "/query/runtimes":
+                    return 200, {"runtimes": self.runtimes}
+                elif path == "/settings":
+                    return 200, self._query_settings(query.get("q", [""])[0])
+            elif method == "POST":
+                form = urllib.parse.parse_qs(body)
+                if path == "/control":
+                    return 200, self._control(form)
+                elif path == "/settings":
+                    return 200, self._settings(form)
+            return 404, self._error("Not found")
+
+    #
+    # HTTP digest authentication (RFC 2617, MD5, qop=auth)
+    #
+
+    def _challenge(self):
+        nonce = os.urandom(16).hex()
+        with self._lock:
+            self._nonces.add(nonce)
+            self.challenges += 1
+        return 'Digest realm="{0}", nonce="{1}", qop="auth", algorithm=MD5'.format(self.realm, nonce)
+
+    def _authorized(self, method, header):
+        if self.user is None:
+            return True
+        if not header or not header.startswith("Digest "):
+            return False
+        fields = {}
+        for item in urllib.request.parse_http_list(header[len("Digest "):]):
+            key, _, value = item.partition("=")
+            fields[key.strip()] = value.strip().strip('"')
+        if fields.get("username") != self.user or fields.get("nonce") not in self._nonces:
+            return False
+        md5 = lambda value: hashlib.md5(value.encode()).hexdigest()
+        ha1 = md5("{0}:{1}:{2}".format(self.user, self.realm, self.password))
+        ha2 = md5("{0}:{1}".format(method, fields.get("uri")))
+        expected = md5(":".join((ha1, fields["nonce"], fields.get("nc", ""), fields.get("cnonce", ""),
+                                 fields.get("qop", ""), ha2)))
+        return fields.get("response") == expected
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # the simulated fleet opens a lot of listening sockets at once
+    request_queue_size = 64
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately; don't let Nagle delay the body
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        thermostat = self.server.thermostat
+        with thermostat._lock:
+            thermostat.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        thermostat = self.server.thermostat
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode() if length else ""
+        if not thermostat._authorized(method, self.headers.get("Authorization")):
+            self._send(401, {"error": True, "reason": "Unauthorized"},
+                       [("WWW-Authenticate", thermostat._challenge())])
+            return
+        url = urllib.parse.urlsplit(self.path)
+        status, payload = thermostat.handle(method, url.path, urllib.parse.parse_qs(url.query), body)
+        self._send(status, payload)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+#
+# Many simulated thermostats, each listening on its own port, served from a
+# single selector thread so that a thousand of them don't need a thousand
+# accept loops.
+#
+class SimulatedFleet:
+    def __init__(self, count, **kwargs):
+        self.thermostats = [SimulatedThermostat(**kwargs) for i in range(count)]
+        self._selector = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def __iter__(self):
+        return iter(self.thermostats)
+
+    def __len__(self):
+        return len(self.thermostats)
+
+    @property
+    def addrs(self):
+        return [thermostat.addr for thermostat in self.thermostats]
+
+    @property
+    def request_count(self):
+        return sum(thermostat.request_count for thermostat in self.thermostats)
+
+    def reset_stats(self):
+        for thermostat in self.thermostats:
+            thermostat.reset_stats()
+
+    def start(self):
+        self._selector = selectors.DefaultSelector()
+        for thermostat in self.thermostats:
+            server = thermostat._server_bind()
+            self._selector.register(server, selectors.EVENT_READ)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, name="venstar-sim-fleet", daemon=True)
+        self._thread.start()
+        return self
+
+    def _serve(self):
+        while not self._stop.is_set():
+            for key, events in self._selector.select(0.1):
+                key.fileobj._handle_request_noblock()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+        for thermostat in self.thermostats:
+            if thermostat._server is not None:
+                thermostat._server.server_close()
+                thermostat._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+#
+# Answers SSDP M-SEARCHes for venstar:thermostat:ecp on behalf of simulated
+# thermostats, the way real ones do.  It listens on a unicast address, so
+# point discovery at it with target=responder.target:
+#
+#   with SimulatedFleet(3) as fleet, SSDPResponder(fleet) as responder:
+#       found = discovery.search(timeout=0.5, target=responder.target)
+#
+class SSDPResponder:
+    SEARCH_TARGET = "venstar:thermostat:ecp"
+
+    def __init__(self, thermostats, host="127.0.0.1", port=0):
+        self.thermostats = list(thermostats)
+        self.host = host
+        self.port = port
+        self.searches = 0
+        self._sock = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def target(self):
+        return (self.host, self.port)
+
+    def _response(self, thermostat):
+        usn = "ecp:{0}:name:{1}:type:{2}".format(thermostat.mac, urllib.parse.quote(thermostat.info.get("name", "")),
+                                                 thermostat.type)
+        return ("HTTP/1.1 200 OK\r\n"
+                "Cache-Control: max-age=300\r\n"
+                "ST: {0}\r\n"
+                "Location: http://{1}/\r\n"
+                "USN: {2}\r\n"
+                "\r\n").format(self.SEARCH_TARGET, thermostat.addr, usn).encode("utf-8")
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((self.host, self.port))
+        self._sock.settimeout(0.1)
+        self.port = self._sock.getsockname()[1]
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, name="venstar-sim-ssdp", daemon=True)
+        self._thread.start()
+        return self
+
+    def _serve(self):
+        while not self._stop.is_set():
+            try:
+                data, sender = self._sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            text = data.decode("utf-8", "replace")
+            if not text.startswith("M-SEARCH") or "ST: " + self.SEARCH_TARGET not in text:
+                continue
+            self.searches += 1
+            for thermostat in self.thermostats:
+                # a thermostat that isn't running doesn't answer
+                if thermostat._server is not None:
+                    self._sock.sendto(self._response(thermostat), sender)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,175 @@
+import enum
+
+
+class Mode(enum.IntEnum):
+    OFF = 0
+    HEAT = 1
+    COOL = 2
+    AUTO = 3
+
+
+class State(enum.IntEnum):
+    IDLE = 0
+    HEATING = 1
+    COOLING = 2
+    LOCKOUT = 3
+    ERROR = 4
+
+
+class Fan(enum.IntEnum):
+    AUTO = 0
+    ON = 1
+
+
+class FanState(enum.IntEnum):
+    OFF = 0
+    ON = 1
+
+
+class TempUnits(enum.IntEnum):
+    F = 0
+    C = 1
+
+
+class Security(enum.IntEnum):
+    OFF = 0
+    ON = 1
+
+
+class Sched(enum.IntEnum):
+    F = 0
+    C = 1
+
+
+class SchedPart(enum.IntEnum):
+    MORNING = 0
+    DAY = 1
+    EVENING = 2
+    NIGHT = 3
+    INACTIVE = 255
+
+
+class Away(enum.IntEnum):
+    HOME = 0
+    AWAY = 1
+
+
+def _enum(cls, value):
+    try:
+        return cls(value)
+    except ValueError:
+        return value
+
+
+#
+# Read-only snapshot of one /query/info (plus /settings) poll.  Built once per
+# changed response; enum-valued fields hold the matching IntEnum member when
+# the thermostat reports a known value, so they still compare equal to the
+# plain integer constants.
+#
+class ThermostatState:
+    __slots__ = ("name", "mode", "state", "fan", "fanstate", "tempunits", "schedule",
+                 "schedulepart", "away", "spacetemp", "heattemp", "cooltemp", "setpointdelta",
+                 "heattempmin", "heattempmax", "cooltempmin", "cooltempmax", "hum",
+                 "hum_setpoint", "dehum_setpoint", "hum_active", "availablemodes")
+
+    _enums = {"mode": Mode, "state": State, "fan": Fan, "fanstate": FanState,
+              "schedulepart": SchedPart, "away": Away}
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            value = fields.get(field)
+            if value is not None and field in self._enums:
+                value = _enum(self._enums[field], value)
+            object.__setattr__(self, field, value)
+
+    #
+    # Values that the client derives rather than reads straight from info
+    # (e.g. the API ``tempunits`` resolved per model) are passed as overrides.
+    #
+    @classmethod
+    def from_info(cls, info, **overrides):
+        fields = {field: info.get(field) for field in cls.__slots__}
+        fields.update(overrides)
+        if fields.get("tempunits") is not None:
+            fields["tempunits"] = _enum(TempUnits, fields["tempunits"])
+        return cls(**fields)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ThermostatState is read-only")
+
+    def _asdict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __eq__(self, other):
+        if not isinstance(other, ThermostatState):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "ThermostatState({0})".format(", ".join(
+            "{0}={1!r}".format(field, getattr(self, field)) for field in self.__slots__))
+
+
+class SensorReading:
+    __slots__ = ("name", "type", "temp", "hum", "battery")
+
+    def __init__(self, name, type=None, temp=None, hum=None, battery=None):
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "type", type)
+        object.__setattr__(self, "temp", temp)
+        object.__setattr__(self, "hum", hum)
+        object.__setattr__(self, "battery", battery)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SensorReading is read-only")
+
+    def _asdict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __eq__(self, other):
+        if not isinstance(other, SensorReading):
+            return NotImplemented
+        return self._asdict() == other._asdict()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "SensorReading(name={0!r}, type={1!r}, temp={2!r}, hum={3!r}, battery={4!r})".format(
+            self.name, self.type, self.temp, self.hum, self.battery)
+
+
+#
+# Everything the client knows about one thermostat at one moment: the info
+# dict (read-only), its ThermostatState, the sensors response and readings,
+# alerts and runtimes.  The client never changes a snapshot; each update
+# publishes a new one in a single assignment, so a reader holding one sees
+# values that belong together while other threads poll or write.
+#
+class ThermostatSnapshot:
+    __slots__ = ("info", "state", "sensors", "sensor_readings", "alerts", "runtimes")
+
+    def __init__(self, info=None, state=None, sensors=None, sensor_readings=(), alerts=None, runtimes=None):
+        object.__setattr__(self, "info", info)
+        object.__setattr__(self, "state", state)
+        object.__setattr__(self, "sensors", sensors)
+        object.__setattr__(self, "sensor_readings", sensor_readings)
+        object.__setattr__(self, "alerts", alerts)
+        object.__setattr__(self, "runtimes", runtimes)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ThermostatSnapshot is read-only")
+
+    def _replace(self, **changes):
+        fields = self._asdict()
+        fields.update(changes)
+        return ThermostatSnapshot(**fields)
+
+    def _asdict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __repr__(self):
+        return "ThermostatSnapshot({0})".format(", ".join(
+            "{0}={1!r}".format(field, getattr(self, field)) for field in self.__slots__))
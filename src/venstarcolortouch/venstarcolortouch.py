@@ -1,152 +1,155 @@
 import json
-import requests
-import urllib3
-import urllib
-import logging
-from requests.auth import HTTPDigestAuth
-
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-MIN_API_VER=3
-# Venstar developers fixed a bug for some models with the 5.28 firmware
-#   version. The new firmware correctly reports temperatures in the
-#   configured temperature unit.
-UNIT_BUG_FIX_VERSION = (5, 28)
-
-class VenstarColorTouch:
-    def __init__(self, addr, timeout, user=None, password=None, pin=None, proto='http', SSLCert=False):
-        #API Constants
-        self.MODE_OFF = 0
-        self.MODE_HEAT = 1
-        self.MODE_COOL = 2
-        self.MODE_AUTO = 3
-        self.STATE_IDLE = 0
-        self.STATE_HEATING = 1
-        self.STATE_COOLING = 2
-        self.STATE_LOCKOUT = 3
-        self.STATE_ERROR = 4
-        self.FAN_AUTO = 0
-        self.FAN_ON = 1
-        self.FANSTATE_OFF = 0
-        self.FANSTATE_ON = 1
-        self.TEMPUNITS_F = 0
-        self.TEMPUNITS_C = 1
-        self.SECURITY_OFF = 0
-        self.SECURITY_ON = 1
-        self.SCHED_F = 0
-        self.SCHED_C = 1
-        self.SCHEDPART_MORNING = 0
-        self.SCHEDPART_DAY = 1
-        self.SCHEDPART_EVENING = 2
-        self.SCHEDPART_NIGHT = 3
-        self.SCHEDPART_INACTIVE = 255
-        self.AWAY_HOME = 0
-        self.AWAY_AWAY = 1
-
-        self.sensor_names = { "Control": [ "Space Temp" ], "Local": [ "Thermostat" ] }
-        self.sensor_types = [ "Control", "Local", "Outdoor", "Remote", "Return", "Supply" ]
-
-        #Input parameters
-        self.addr = addr
-        self.timeout = timeout
-
-        #Use Python standard logging class
-        self.log = logging.getLogger(__name__)
-
-        #Preprocess authentication related parameters
-        if pin is not None:
-            self.pin = str(pin).zfill(4)
+import time
+import threading
+import functools
+import urllib.parse
+
+from .base import (VenstarColorTouchBase, MIN_API_VER, UNIT_BUG_FIX_VERSION, SETTINGS_ATTRS, UPDATE_WORKERS,
+                   POOL_MAXSIZE)
+
+#
+# set_* calls on one instance run one at a time (set_away() calling
+# set_schedule() re-enters), so each builds its request from the previous
+# one's result and a poll finishing meanwhile can't undo it locally.
+#
+def _serialized(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._lock_writes()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._unlock_writes()
+    return wrapper
+
+class VenstarColorTouch(VenstarColorTouchBase):
+    def __init__(self, addr, timeout, user=None, password=None, pin=None, proto='http', SSLCert=False,
+                 runtimes_store=None, optimistic=False, verify_delay=2.0, session=None, pool_maxsize=POOL_MAXSIZE, max_retries=0,
+                 capability_cache=None, connect_timeout=None, breaker=None,
+                 instrumentation=None):
+        super().__init__(addr, timeout, user=user, password=password, pin=pin, proto=proto, SSLCert=SSLCert,
+                         runtimes_store=runtimes_store, optimistic=optimistic, verify_delay=verify_delay,
+                         capability_cache=capability_cache, connect_timeout=connect_timeout, breaker=breaker,
+                         instrumentation=instrumentation)
+        if connect_timeout is not None:
+            self._timeouts = (connect_timeout, timeout)
         else:
-            self.pin = None
+            self._timeouts = timeout
+
+        self._auth = None
 
-        if user != None and password != None:
-            self.auth = HTTPDigestAuth(user, password)
-        else:
-            self.auth = None
-
-        self.proto = proto
-        self.SSLCert = SSLCert
-
-        #Initialize State
-        self.status = {}
-        self.model = None
-        self._api_ver = None
-        self._type = None
-        self._info = None
-        self._sensors = None
-        self._firmware_ver = None
-        self.alerts = None
-        self.runtimes = None
-        #
-        # /control
-        #
-        self.setpointdelta = None
-        self.heattemp = None
-        self.cooltemp = None
-        self.fan = None
-        self.mode = None
-        self.fanstate = None
-        self.state = None
         #
-        # /settings
+        # HTTP connection pool.  A requests.Session keeps connections to the
+        # thermostat alive between calls and, together with the single
+        # HTTPDigestAuth instance below, lets the digest nonce be reused
+        # instead of re-challenging on every request.  A caller supplied
+        # session is used as-is and is not closed by close().
         #
-        self.name = None
-        self.tempunits = None
-        self.away = None
-        self.schedule = None
-        self.hum_setpoint = None
-        self.dehum_setpoint = None
-        self.hum_active = None
-        self.security = None
-        self.sp_min = None
-        self.sp_max = None
-
-    def login(self):
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self._session = session
+        self._owns_session = session is None
+        self._session_ready = False
+
+        self._executor = None
+        self._settings_executor = None
+        # held across each set_* call, its request and the refresh after it
+        self._write_lock = threading.RLock()
+
+    def login(self, force=False):
+        # A warm capability cache answers without asking the thermostat
+        if not force and self._login_cached():
+            return True
         r = self._request("/")
         if r is False:
-            self.log.error("Failed to request thermostat info in login")
+            if not self.breaker.consecutive_failures:
+                self.log.error("Failed to request thermostat info in login")
             return r
-        j = r.json()
-        if j["api_ver"] >= MIN_API_VER:
-            self._api_ver = j["api_ver"]
-            if "firmware" in j:
-                self._firmware_ver = tuple(map(int, j["firmware"].split(".")))
-            else:
-                self._firmware_ver = (0,0)
-            logging.debug("api_ver: %s" % self._api_ver)
-            self._type = j["type"]
-            if "model" in j:
-                self.model = j["model"]
-            else:
-                self.model = "COLORTOUCH"
-            return True
-        else:
-            self.log.error("Unsupported API version: %s", j["api_ver"])
+        if not self._parse_login(self._json(r)):
             return False
+        self._remember_login()
+        return True
+
+    @property
+    def auth(self):
+        if self._auth is None and self.user is not None and self.password is not None:
+            from requests.auth import HTTPDigestAuth
+            self._auth = HTTPDigestAuth(self.user, self.password)
+        return self._auth
+
+    @auth.setter
+    def auth(self, auth):
+        self._auth = auth
+
+    #
+    # requests (and urllib3 under it) takes longer to import than everything
+    # else here put together, so it is only imported when the first request
+    # is made; constructing a VenstarColorTouch doesn't need it.
+    #
+    def _get_session(self):
+        if not self._session_ready:
+            import requests
+            import requests.adapters
+            if self._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                        pool_maxsize=self.pool_maxsize,
+                                                        max_retries=self.max_retries)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            self._session_ready = True
+        return self._session
+
+    def close(self):
+        if self._verify_handle is not None:
+            self._verify_handle.cancel()
+            self._verify_handle = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._settings_executor is not None:
+            self._settings_executor.shutdown(wait=False)
+            self._settings_executor = None
+        if self._session is not None and self._owns_session:
+            self._session.close()
+            self._session = None
+            self._session_ready = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
     def _request(self, path, data=None):
-        # All calls to _request must have leading slash in path
-        uri = "{proto}://{addr}{path}".format(proto=self.proto, addr=self.addr, path=path)
-        params = {}
-        if self.pin:
-            params['pin'] = self.pin
+        uri = self._uri(path)
+        params = self._params()
+        session = self._get_session()
+        if data is not None:
+            # set_* functions change local state before writing it
+            self._info_valid = False
+        if self._circuit_open(path, uri):
+            return False
+        start = time.perf_counter()
         try:
             if data is not None:
-                req = requests.post(uri,
-                                    verify=self.SSLCert,
-                                    timeout=self.timeout,
-                                    data=data,
-                                    params=params,
-                                    auth=self.auth)
-            else:
-                req = requests.get(uri,
+                req = session.post(uri,
                                    verify=self.SSLCert,
-                                   timeout=self.timeout,
+                                   timeout=self._timeouts,
+                                   data=data,
                                    params=params,
                                    auth=self.auth)
+            else:
+                req = session.get(uri,
+                                  verify=self.SSLCert,
+                                  timeout=self._timeouts,
+                                  params=params,
+                                  auth=self.auth)
         except Exception as ex:
-            self.log.exception("Error requesting {uri} from Venstar ColorTouch.".format(uri=uri))
+            self._request_failed(path, uri, ex)
             return False
+        self._request_succeeded(path, "GET" if data is None else "POST", start, req)
 
         if not req.ok:
             self.log.error("Connection error logging into Venstar ColorTouch. Status Code: {status}".format(status=req.status_code))
@@ -154,7 +157,9 @@ class VenstarColorTouch:
 
         return req
 
-    def update(self, alerts = True, info = True, runtimes = True, sensors = True):
+    def update(self, alerts = True, info = True, runtimes = True, sensors = True, concurrent = False):
+        if concurrent:
+            return self._update_concurrent(alerts, info, runtimes, sensors)
         if alerts:
             if not self.update_alerts():
                 return False
@@ -169,13 +174,73 @@ class VenstarColorTouch:
                 return False
         return True
 
-    def update_info(self):
-        # Model number (set during login) *required* for this function
+    #
+    # Issue the requested queries in parallel on a small thread pool and merge
+    # whatever came back into the local state once all of them have finished.
+    # Unlike the serial update(), one failing endpoint does not stop the others;
+    # per-endpoint success is left in self.update_results.
+    #
+    def _update_concurrent(self, alerts, info, runtimes, sensors):
+        fetchers = {}
+        if alerts:
+            fetchers["alerts"] = self.get_alerts
+        if info:
+            fetchers["info"] = self._fetch_info
+        if runtimes:
+            fetchers["runtimes"] = self.get_runtimes
+        if sensors:
+            fetchers["sensors"] = self._fetch_sensors
+
+        since = self._writes
+        executor = self._get_executor()
+        futures = {endpoint: executor.submit(self._fetch_safely, endpoint, fetch)
+                   for endpoint, fetch in fetchers.items()}
+        fetched = {endpoint: future.result() for endpoint, future in futures.items()}
+
+        self.update_results = self._apply_updates(fetched, since)
+        return all(self.update_results.values())
+
+    def _get_executor(self):
+        if self._executor is None:
+            import concurrent.futures
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=UPDATE_WORKERS,
+                                                                   thread_name_prefix="venstar")
+        return self._executor
+
+    # _fetch_info() already runs on _executor in concurrent mode, so the
+    # settings it asks for one at a time get a pool of their own rather
+    # than waiting for free workers in the same one
+    def _get_settings_executor(self):
+        if self._settings_executor is None:
+            import concurrent.futures
+            self._settings_executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(SETTINGS_ATTRS),
+                                                                            thread_name_prefix="venstar-settings")
+        return self._settings_executor
+
+    def _fetch_safely(self, endpoint, fetch):
+        try:
+            return fetch()
+        except Exception:
+            self.log.exception("Failed to update {0} from Venstar ColorTouch.".format(endpoint))
+            return False
+
+    def _login_for_info(self):
+        # Model number (set during login) *required* for update_info()
         if self.model is None:
             self.log.debug("update_info() called without login(), executing login()")
             if not self.login():
-                self.log.error("Login failed during update_info() call!")
+                if not self.breaker.consecutive_failures:
+                    self.log.error("Login failed during update_info() call!")
                 return False
+        return True
+
+    #
+    # Fetch /query/info plus any settings this model only reports at
+    # /settings, without touching the local state.
+    #
+    def _fetch_info(self):
+        if not self._login_for_info():
+            return False
 
         r = self._request("/query/info")
 
@@ -183,177 +248,108 @@ class VenstarColorTouch:
             return r
 
         try:
-            self._info=r.json()
+            # copied because settings get merged in below
+            info = dict(self._decode("info", r))
         except json.decoder.JSONDecodeError as error:
             self.log.error("Failed to decode JSON: %s", error.msg)
             return False
 
-        #
-        # Populate /control stuff
-        #
-        self.setpointdelta=self.get_info("setpointdelta")
-        self.heattemp=self.get_info("heattemp")
-        self.cooltemp=self.get_info("cooltemp")
-        self.fan=self.get_info("fan")
-        self.fanstate=self.get_info("fanstate")
-        self.mode=self.get_info("mode")
-        self.state=self.get_info("state")
+        attrs = self._settings_to_fetch(info)
+        if attrs:
+            info.update(self._fetch_settings(attrs))
+        return info
 
-        #
-        # Populate /settings stuff
-        #
-        self.name = self.get_info("name")
-        self.display_tempunits = self.get_settings("tempunits")
-        if self._type != "commercial":  #Commercial thermostats don't support "away"
-          self.away = self.get_settings("away")
-        self.schedule = self.get_settings("schedule")
-        self.hum_setpoint = self.get_settings("hum_setpoint")
-        self.dehum_setpoint = self.get_settings("dehum_setpoint")
-        #
-        if "hum_active" in self._info:
-            self.hum_active = self.get_info("hum_active")
-        else:
-            self.hum_active = 0
-        self.sp_min = self.get_info("cooltempmin")
-        self.sp_max = self.get_info("heattempmax")
+    def _query_settings(self, attrs):
+        r = self._request(self._settings_query(attrs))
+        if not r:
+            return None
+        j = self._json(r)
+        return {attr: j[attr] for attr in attrs if attr in j}
 
-        #
-        # T2xxx, T3xxx thermostats with firmware < 5.28 always use Celsius in the
-        # API regardless of the display units, so handle this case accordingly
-        if self.model.startswith(("T2", "T3")) and self.get_firmware_ver() < UNIT_BUG_FIX_VERSION:
-            # Always degC for firmware <= 5.28
-            self.tempunits = self.TEMPUNITS_C
-            logging.debug("Detected thermostat model %s, using temp units of Celsius", self.model)
-        elif (self.model in ["VYG-4900-VEN", "VYG-4800-VEN", "VYG-3800", "VYG-3900", "COLORTOUCH"] or
-              self.model.startswith(("T2", "T3"))):
-            # Same as display units
-            self.tempunits = self.display_tempunits
-        elif self.get_info("heattempmax") >= 40:
-            # Heat max temp over 40, only possible if degF
-            logging.warning("Unknown thermostat model %s, inferring API tempunits of Fahrenheit", self.model)
-            self.tempunits = self.TEMPUNITS_F
-        else:
-            logging.warning("Unknown thermostat model %s, inferring API tempunits of Celsius", self.model)
-            self.tempunits = self.TEMPUNITS_C
+    #
+    # Some models only return settings at /settings.  Ask for all of them in
+    # one request where the firmware allows it, otherwise one request per
+    # setting, in parallel.
+    #
+    def _fetch_settings(self, attrs):
+        batched = None
+        tried = self._try_batch(attrs)
+        if tried:
+            batched = self._query_settings(attrs)
+
+        singles = {}
+        rest = self._settings_rest(attrs, batched)
+        if len(rest) > 1:
+            singles = dict(zip(rest, self._get_settings_executor().map(lambda attr: self._query_settings([attr]), rest)))
+        elif rest:
+            singles = {rest[0]: self._query_settings(rest)}
+        return self._learn_settings(attrs, batched, singles, tried)
+
+    def update_info(self):
+        since = self._writes
+        info = self._fetch_info()
+        if info is False:
+            return False
+
+        self._set_info(info, since)
         return True
 
-    def update_sensors(self):
+    def _fetch_sensors(self):
         r = self._request("/query/sensors")
         if r is False:
             return r
-        self._sensors = r.json()
+        return self._decode("sensors", r)
+
+    def update_sensors(self):
+        sensors = self._fetch_sensors()
+        if sensors is False:
+            return sensors
+        self._set_sensors(sensors)
         return True
 
     # returns a list of all runtime records. get_runtimes()[-1] should be the last one.
-    # runtimes are updated every day (86400 seconds).
-    def get_runtimes(self):
+    # runtimes are updated every day (86400 seconds), so they are only downloaded
+    # again once a new day has started (or when force is set).
+    def get_runtimes(self, force=False):
+        if not force:
+            cached = self._cached_runtimes()
+            if cached is not None:
+                return cached
         r = self._request("/query/runtimes")
         if r is False:
             return r
         else:
-            runtimes=r.json()
-            return runtimes["runtimes"]
+            runtimes=self._decode("runtimes", r)
+            return self._store_runtimes(runtimes["runtimes"])
 
     def update_runtimes(self):
-        self.runtimes = self.get_runtimes()
+        self._set_runtimes(self.get_runtimes())
         if self.runtimes:
             return True
         return False
 
-    def get_info(self, attr=None):
-        if attr is None:
-            return self._info.copy()
-        return self._info[attr]
-
     def get_settings(self, attr):
-        if attr in self._info:
-            return self.get_info(attr)
+        info = self.get_info()
+        if attr in info:
+            return info[attr]
 
         # some models only return settings at this endpoint
         r = self._request(f"/settings?q={attr}")
         if not r:
             return None
 
-        setting = r.json().get(attr)
-        self._info[attr] = setting
-
-        return setting
-
-    def get_api_ver(self):
-        return self._api_ver
-
-    def get_firmware_ver(self):
-        return self._firmware_ver
-
-    def get_type(self):
-        return self._type
-
-    def get_sensor(self, name, attr):
-        if self._sensors != None and self._sensors["sensors"] != None and len(self._sensors["sensors"]) > 0:
-            for sensor in self._sensors["sensors"]:
-                # 'hum' (humidity) sensor is not present on T5800 series
-                if "name" in sensor and sensor["name"] == name and attr in sensor:
-                    return sensor[attr]
-                elif "name" in sensor and sensor["name"] == name and attr not in sensor and attr == "type" and sensor["name"] in self.sensor_types:
-                    return sensor["name"]
-                elif "name" in sensor and sensor["name"] == name and attr not in sensor and attr == "type" and sensor["name"] in self.sensor_names["Control"]:
-                    return "Control"
-                elif "name" in sensor and sensor["name"] == name and attr not in sensor and attr == "type" and sensor["name"] in self.sensor_names["Local"]:
-                    return "Local"
-        return None
-
-    def get_sensor_list(self, type=None):
-        names = [];
-        if self._sensors != None and self._sensors["sensors"] != None and len(self._sensors["sensors"]) > 0:
-            for sensor in self._sensors["sensors"]:
-                if "name" in sensor:
-                    if type != None:
-                        if "type" in sensor and sensor["type"] == type:
-                            names.append(sensor["name"])
-                        elif type not in sensor and sensor["name"] in self.sensor_types and sensor["name"] == type:
-                            names.append(sensor["name"])
-                        elif type not in sensor and sensor["name"] in self.sensor_names["Control"] and type == "Control":
-                            names.append(sensor["name"])
-                        elif type not in sensor and sensor["name"] in self.sensor_names["Local"]  and type == "Local":
-                            names.append(sensor["name"])
-                    else:
-                        names.append(sensor["name"])
-        return names
-
-    def get_thermostat_sensor(self, attr):
-        sensors = self.get_sensor_list("Local")
-        if len(sensors) > 0:
-            return self.get_sensor(sensors[0], attr)
-        return None
-
-    def get_outdoor_sensor(self, attr):
-        sensors = self.get_sensor_list("Outdoor")
-        if len(sensors) > 0:
-            return self.get_sensor(sensors[0], attr)
-        return None
-
-    def get_indoor_temp(self):
-        sensors = self.get_sensor_list("Control") + self.get_sensor_list("Local")
-        if len(sensors) > 0:
-            return self.get_sensor(sensors[0], "temp")
-        return None
-
-    def get_outdoor_temp(self):
-        return self.get_outdoor_sensor("temp")
-
-    def get_indoor_humidity(self):
-        return self.get_thermostat_sensor("hum")
+        return self._store_setting(attr, self._json(r))
 
     def get_alerts(self):
         r = self._request("/query/alerts")
         if r is False:
             return r
         else:
-            alerts=r.json()
+            alerts=self._decode("alerts", r)
             return alerts["alerts"]
 
     def update_alerts(self):
-        self.alerts = self.get_alerts()
+        self._set_alerts(self.get_alerts())
         if self.alerts:
             return True
         return False
@@ -361,102 +357,131 @@ class VenstarColorTouch:
     def parse_response(self, r, setting, update_info=False):
         if r is False or r is None:
             return False
+        try:
+            j = self._json(r)
+        except json.decoder.JSONDecodeError as error:
+            self.log.error("Failed to decode JSON: %s", error.msg)
+            return False
+        if "success" in j:
+            self.log.debug("{0} Success!".format(setting))
+            if update_info:
+                self.update_info()
+            return True
         else:
-            try:
-                if "success" in r.json():
-                    self.log.debug("{0} Success!".format(setting))
-                    if update_info:
-                        self.update_info()
-                    return True
-                else:
-                    self.log.error("{0} Fail {1}.".format(setting, r.text))
-                    return False
-            except json.decoder.JSONDecodeError as error:
-                self.log.error("Failed to decode JSON: %s", error.msg)
-                return False
+            self.log.error("{0} Fail {1}.".format(setting, r.text))
+            return False
+
+    def _lock_writes(self):
+        self._write_lock.acquire()
+        self._begin_write(threading.get_ident())
 
+    def _unlock_writes(self):
+        self._end_write()
+        self._write_lock.release()
+
+    @_serialized
     def set_control(self, data):
         path="/control"
         r = self._request(path, data)
         return self.parse_response(r, 'set_control')
 
-    # When setting MODE, you must also set heattemp/cooltemp.
-    # The set of legal operations is:
-    # When setting fan, only set fan.
-    # When setting heat/cool, set both heat cool and nothing else.
-    # When setting mode, set mode, heat and cool.
+    #
+    # POST fields to path, or queue them if a batch() is in progress.
+    #
+    def _write(self, path, fields, setting, update_info=False):
+        if self._batch is not None:
+            self._batch.add(path, fields, update_info)
+            return True
+        r = self._request(path, urllib.parse.urlencode(fields))
+        if not self.optimistic:
+            return self.parse_response(r, setting, update_info=update_info)
+        ok = self.parse_response(r, setting)
+        if ok:
+            self._apply_written(fields)
+            self._schedule_verify()
+        return ok
 
+    #
+    # (Re)start the timer for the deferred read that verifies optimistic
+    # writes, so a burst of writes is verified once.
+    #
+    def _schedule_verify(self):
+        if self._verify_handle is not None:
+            self._verify_handle.cancel()
+        self._verify_handle = threading.Timer(self.verify_delay, self._verify)
+        self._verify_handle.daemon = True
+        self._verify_handle.start()
+
+    def _verify(self):
+        self._verify_handle = None
+        if not self.update_info():
+            self.log.warning("Failed to verify written settings on {0}".format(self.addr))
+
+    def _flush_batch(self, batch):
+        plan = self._batch_plan(batch)
+        if plan is None:
+            self._info_valid = False
+            return False
+        for path, fields, setting in plan:
+            ok = self._write(path, fields, setting)
+            batch.results.append((setting, ok))
+            if not ok:
+                break
+        if batch.refresh and not self.optimistic and any(ok for setting, ok in batch.results):
+            self.update_info()
+        return all(ok for setting, ok in batch.results)
+
+    @_serialized
     def set_setpoints(self, heattemp, cooltemp):
-        # Must not violate setpointdelta if we're in auto mode.
-        if self.mode == self.MODE_AUTO and heattemp + self.setpointdelta > cooltemp:
-            self.log.warning("In auto mode, the cool temp must be {0} "
-                  "degrees warmer than the heat temp.".format(self.setpointdelta))
+        fields = self._setpoints_fields(heattemp, cooltemp)
+        if fields is None:
             return False
-        # Round to two decimal places because
-        # ColorTouch T8900 (and possibly others) throws "Both Setpoints are required" 
-        # if a heat or cool temp with 3 decimal places or more is sent 
-        self.heattemp = round(heattemp, 2)
-        self.cooltemp = round(cooltemp, 2)
-        data = urllib.parse.urlencode({'heattemp':self.heattemp, 'cooltemp':self.cooltemp})
-        return self.set_control(data)
+        return self._write("/control", fields, 'set_control')
 
+    @_serialized
     def set_mode(self, mode):
-        self.mode = mode
-        data = urllib.parse.urlencode({'mode': self.mode, 'heattemp':self.heattemp, 'cooltemp':self.cooltemp})
-        return self.set_control(data)
+        return self._write("/control", self._mode_fields(mode), 'set_control')
 
+    @_serialized
     def set_fan(self, fan):
-        self.fan = fan
-        data = urllib.parse.urlencode({'fan': self.fan})
-        return self.set_control(data)
+        return self._write("/control", self._fan_fields(fan), 'set_control')
 
     #
     # set_settings can't change the schedule or away while schedule is on, so no point in trying.
     #
+    @_serialized
     def set_settings(self):
-        if self.tempunits is None:
-            self.log.error("update_info() must be called before settings may be set, aborting!")
+        fields = self._settings_fields()
+        if fields is None:
             return False
-        path="/settings"
-        data = urllib.parse.urlencode({'tempunits':self.display_tempunits, 'hum_setpoint':self.hum_setpoint, 'dehum_setpoint':self.dehum_setpoint})
-        r = self._request(path, data)
-        return self.parse_response(r, 'set_settings', update_info=True)
+        return self._write("/settings", fields, 'set_settings', update_info=True)
 
+    @_serialized
     def set_security(self, security):
         if security not in [self.SECURITY_ON, self.SECURITY_OFF]:
             return False
-        path = "/settings"
-        data = urllib.parse.urlencode({'security': security})
-        r = self._request(path, data)
+        ret = self._write("/settings", {'security': security}, 'set_security')
         self.security = security
-        return self.parse_response(r, 'set_security')
+        return ret
 
+    @_serialized
     def set_setpoint_limits(self, sp_max=None, sp_min=None):
         if (sp_max == self.sp_max and sp_min == self.sp_min) or (sp_max is None and sp_min is None):
             return True
-        path = "/settings"
         # Make sure security is on
         if self.security == 0:
             self.set_security(1)
-        sp_limit_data = {}
-        if sp_max is not None:
-            sp_limit_data['spMax'] = sp_max
-        if sp_min is not None:
-            sp_limit_data['spMin'] = sp_min
-        data = urllib.parse.urlencode(sp_limit_data)
-        r = self._request(path, data)
-        return self.parse_response(r, 'set_setpoint_limits', update_info=True)
+        fields = self._setpoint_limits_fields(sp_max, sp_min)
+        return self._write("/settings", fields, 'set_setpoint_limits', update_info=True)
 
+    @_serialized
     def set_tempunits(self, tempunits):
         self.tempunits = tempunits
         return self.set_settings()
 
+    @_serialized
     def set_away(self, away):
-        if self.away is None:
-            self.log.error("update_info() must be called before away mode may be changed, aborting!")
-            return False
-        if not self._type.lower() == "residential":
-            self.log.error("Away mode is not supported on commercial thermostat models.")
+        if not self._check_away():
             return False
 
         if self.away == away:
@@ -466,17 +491,14 @@ class VenstarColorTouch:
             if ret == False:
                 return ret
         self.away = away
-        path="/settings"
-        data = urllib.parse.urlencode({'away':self.away})
-        r = self._request(path, data)
-        return self.parse_response(r, 'set_away', update_info=True)
+        return self._write("/settings", {'away':self.away}, 'set_away', update_info=True)
 
     #
     # We can't change any settings while the schedule is active so we can't use set_settings()
     #
+    @_serialized
     def set_schedule(self, schedule):
-        if self.schedule is None:
-            self.log.error("update_info() must be called before schedule state may be changed, aborting!")
+        if not self._check_schedule():
             return False
 
         if (self.schedule == schedule):
@@ -487,11 +509,9 @@ class VenstarColorTouch:
         if (self.away == 1):
             return False
         self.schedule = schedule
-        path="/settings"
-        data = urllib.parse.urlencode({'schedule':self.schedule})
-        r = self._request(path, data)
-        return self.parse_response(r, 'set_schedule', update_info=True)
+        return self._write("/settings", {'schedule':self.schedule}, 'set_schedule', update_info=True)
 
+    @_serialized
     def set_hum_setpoint(self, hum_setpoint):
         if self.hum_setpoint is None:
             self.log.warning("No humidifier support detected, ignoring set_hum_setpoint call!")
@@ -499,6 +519,7 @@ class VenstarColorTouch:
         self.hum_setpoint = hum_setpoint
         return self.set_settings()
 
+    @_serialized
     def set_dehum_setpoint(self, dehum_setpoint):
         if self.dehum_setpoint is None:
             self.log.warning("No dehumidification control support detected, ignoring set_dehum_setpoint call!")